@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2025 Oxhead Alpha
+# SPDX-License-Identifier: LicenseRef-MIT-OA
+
+"""
+Local stand-in for the snapshot providers serving a synthetic snapshot.
+
+Mimics the TzInit API at /tzinit/<region>/<network>/<history mode>[.json]
+and the Marigold one at /marigold/tezos-snapshots.json, with Range and ETag
+support, throttling and injected failures, so that the snapshot download
+and the provider selection can be exercised without the internet.
+
+Run from the 'baking' directory:
+    PYTHONPATH=src python3 benchmarks/provider_server.py --size 512M
+and point tezos-setup to it with:
+    TEZOS_TZINIT_URL='http://127.0.0.1:8760/tzinit/{region}' \\
+    TEZOS_MARIGOLD_URL=http://127.0.0.1:8760/marigold/tezos-snapshots.json \\
+    tezos-setup
+"""
+
+import os
+import json
+import time
+import random
+import hashlib
+import argparse
+import tempfile
+import threading
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+from tezos_baking.downloader import parse_rate_limit
+from tezos_baking.tezos_snapshot_relay import parse_range
+
+networks = ["mainnet", "ghostnet"]
+history_modes = ["rolling", "full"]
+regions = ["eu", "us", "asia"]
+# Size of the body written to the socket at once
+SEND_CHUNK_SIZE = 64 * 1024
+
+
+# Can be changed while the server is running, e.g. to interrupt a download
+@dataclass
+class Behavior:
+    # in bytes per second for every response, unlimited if None
+    rate: Optional[int] = None
+    # overrides the rate of the TzInit regions
+    region_rates: Dict[str, int] = field(default_factory=dict)
+    # in seconds, before every response
+    latency: float = 0
+    # probability of the 503 response
+    error_rate: float = 0
+    # probability of the snapshot response being cut in the middle
+    failure_rate: float = 0
+
+
+@dataclass
+class Snapshot:
+    path: str
+    size: int
+    sha256: str
+    etag: str
+
+
+# Writes `size` random bytes to `path`
+def mk_snapshot_file(path, size, seed=0):
+    rng = random.Random(seed)
+    sha256 = hashlib.sha256()
+    with open(path, "wb") as f:
+        written = 0
+        while written < size:
+            chunk = rng.getrandbits(8 * min(1024**2, size - written)).to_bytes(
+                min(1024**2, size - written), "little"
+            )
+            f.write(chunk)
+            sha256.update(chunk)
+            written += len(chunk)
+    stat = os.stat(path)
+    return Snapshot(path, size, sha256.hexdigest(), f'"{size:x}-{stat.st_mtime_ns:x}"')
+
+
+def mk_snapshot_header(network, history_mode, level):
+    return {
+        "version": 8,
+        "chain_name": f"TEZOS_{network.upper()}",
+        "mode": history_mode,
+        "block_hash": "B"
+        + hashlib.sha256(f"{network}{level}".encode()).hexdigest()[:50],
+        "level": level,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def mk_marigold_artifact(base_url, snapshot, network, history_mode, level, version):
+    major, minor, rc = version
+    header = mk_snapshot_header(network, history_mode, level)
+    return {
+        "artifact_type": "tezos-snapshot",
+        "chain_name": network,
+        "history_mode": history_mode,
+        "block_hash": header["block_hash"],
+        "block_height": level,
+        "block_timestamp": header["timestamp"],
+        "url": f"{base_url}/marigold/snapshots/{network}-{level}.{history_mode}",
+        "filename": f"{network}-{level}.{history_mode}",
+        "filesize_bytes": snapshot.size,
+        "filesize": f"{snapshot.size} B",
+        "sha256": snapshot.sha256,
+        "tezos_version": {
+            "version": {
+                "major": major,
+                "minor": minor,
+                "additional_info": "release" if rc is None else {"rc": rc},
+            }
+        },
+        "snapshot_version": 8,
+    }
+
+
+class ProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def handle_request(self, send_body):
+        behavior = self.server.behavior
+        if behavior.latency:
+            time.sleep(behavior.latency)
+        if random.random() < behavior.error_rate:
+            self.send_error(503)
+            return
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if parts[:1] == ["tzinit"] and len(parts) == 4 and parts[1] in regions:
+            _, region, network, name = parts
+            if name.endswith(".json"):
+                header = mk_snapshot_header(
+                    network, name[: -len(".json")], self.server.level
+                )
+                self.send_json({"snapshot_header": header}, send_body)
+            else:
+                rate = behavior.region_rates.get(region, behavior.rate)
+                self.send_snapshot(send_body, rate)
+        elif parts == ["marigold", "tezos-snapshots.json"]:
+            self.send_json({"data": self.server.listing}, send_body)
+        elif parts[:2] == ["marigold", "snapshots"]:
+            self.send_snapshot(send_body, behavior.rate)
+        else:
+            self.send_error(404)
+
+    def send_json(self, value, send_body):
+        body = json.dumps(value).encode()
+        etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+        if self.headers.get("If-None-Match", None) == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def send_snapshot(self, send_body, rate):
+        snapshot = self.server.snapshot
+        byte_range = None
+        range_header = self.headers.get("Range", None)
+        if_range = self.headers.get("If-Range", None)
+        if range_header is not None and if_range in [None, snapshot.etag]:
+            try:
+                byte_range = parse_range(range_header, snapshot.size)
+            except ValueError:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{snapshot.size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+        start, end = (0, snapshot.size) if byte_range is None else byte_range
+
+        self.send_response(200 if byte_range is None else 206)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", snapshot.etag)
+        self.send_header("Content-Length", str(end - start))
+        if byte_range is not None:
+            self.send_header(
+                "Content-Range", f"bytes {start}-{end - 1}/{snapshot.size}"
+            )
+        self.end_headers()
+        if not send_body:
+            return
+
+        # the response is cut at the random point of the body
+        cut_at = end
+        if random.random() < self.server.behavior.failure_rate:
+            cut_at = random.randint(start, end - 1)
+        started_at = time.monotonic()
+        sent = 0
+        try:
+            with open(snapshot.path, "rb") as f:
+                f.seek(start)
+                while start + sent < cut_at:
+                    chunk = f.read(min(SEND_CHUNK_SIZE, cut_at - start - sent))
+                    self.wfile.write(chunk)
+                    sent += len(chunk)
+                    if rate:
+                        delay = sent / rate - (time.monotonic() - started_at)
+                        if delay > 0:
+                            time.sleep(delay)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        if cut_at < end:
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ProviderServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        snapshot,
+        address=("127.0.0.1", 0),
+        behavior=None,
+        level=1000000,
+        version=(22, 0, None),
+        extra_artifacts=[],
+    ):
+        super().__init__(address, ProviderHandler)
+        self.snapshot = snapshot
+        self.behavior = Behavior() if behavior is None else behavior
+        self.level = level
+        self.listing = [
+            mk_marigold_artifact(
+                self.base_url, snapshot, network, history_mode, level, version
+            )
+            for network in networks
+            for history_mode in history_modes
+        ] + extra_artifacts
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def tzinit_url(self):
+        return self.base_url + "/tzinit/{region}"
+
+    @property
+    def marigold_url(self):
+        return self.base_url + "/marigold/tezos-snapshots.json"
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve a synthetic snapshot the way the snapshot providers do."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8760)
+    parser.add_argument(
+        "--size",
+        type=parse_rate_limit,
+        default=256 * 1024**2,
+        help="Size of the snapshot, e.g. '512M'.",
+    )
+    parser.add_argument(
+        "--rate",
+        type=parse_rate_limit,
+        default=None,
+        help="Bytes per second of every response, e.g. '10M'.",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0, help="Delay of every response."
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0,
+        help="Probability of the 503 response.",
+    )
+    parser.add_argument(
+        "--failure-rate",
+        type=float,
+        default=0,
+        help="Probability of the snapshot response being cut.",
+    )
+    parser.add_argument(
+        "--node-version",
+        default="22.0",
+        help="Octez version of the listed snapshots, e.g. '22.0'.",
+    )
+    args = parser.parse_args()
+
+    major, minor = map(int, args.node_version.split("."))
+    directory = tempfile.mkdtemp(prefix="tezos-provider-")
+    print(f"Generating {args.size} bytes snapshot in {directory}...")
+    snapshot = mk_snapshot_file(os.path.join(directory, "snapshot"), args.size)
+    server = ProviderServer(
+        snapshot,
+        (args.host, args.port),
+        Behavior(args.rate, {}, args.latency, args.error_rate, args.failure_rate),
+        version=(major, minor, None),
+    )
+    print(f"TEZOS_TZINIT_URL='{server.tzinit_url}'")
+    print(f"TEZOS_MARIGOLD_URL='{server.marigold_url}'")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(snapshot.path)
+        os.rmdir(directory)
+
+
+if __name__ == "__main__":
+    main()
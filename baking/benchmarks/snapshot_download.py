@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2025 Oxhead Alpha
+# SPDX-License-Identifier: LicenseRef-MIT-OA
+
+"""
+Measures the snapshot download, resume, hash and provider selection
+throughput against the local stand-in providers, see provider_server.py.
+
+Run from the 'baking' directory:
+    PYTHONPATH=src python3 benchmarks/snapshot_download.py
+"""
+
+import os
+import time
+import hashlib
+import argparse
+import tempfile
+import threading
+import urllib.error
+
+# the cached TzInit region and the listings of the previous runs aren't used
+os.environ["XDG_CACHE_HOME"] = tempfile.mkdtemp(prefix="tezos-benchmark-cache-")
+
+from tezos_baking.util import get_json_cached
+from tezos_baking.provider import TzInit, Marigold
+from tezos_baking.downloader import *
+import tezos_baking.downloader as downloader
+
+from provider_server import *
+from snapshot_selection import mk_listing
+
+
+def throughput(size, elapsed):
+    return f"{size / elapsed / 1024**2:8.1f} MB/s"
+
+
+def report(name, size, elapsed):
+    print(f"{name:>36}: {elapsed:7.2f} s {throughput(size, elapsed)}")
+
+
+def measure(f):
+    start = time.perf_counter()
+    result = f()
+    return (time.perf_counter() - start, result)
+
+
+def check_sha256(snapshot, sha256):
+    if sha256 != snapshot.sha256:
+        raise RuntimeError(f"SHA256 mismatch: {sha256} != {snapshot.sha256}")
+
+
+def bench_download(server, directory, connections):
+    snapshot = server.snapshot
+    url = server.base_url + "/marigold/snapshots/mainnet.rolling"
+    filename = os.path.join(directory, "download.snapshot")
+
+    for n in connections:
+        elapsed, sha256 = measure(
+            lambda: download_in_segments(url, filename, connections=n)
+        )
+        check_sha256(snapshot, sha256)
+        report(f"segmented, {n} connections", snapshot.size, elapsed)
+
+    def sequentially():
+        with open(filename, "wb") as f:
+            return download_sequentially(url, f)
+
+    elapsed, sha256 = measure(sequentially)
+    check_sha256(snapshot, sha256)
+    report("sequential", snapshot.size, elapsed)
+
+    def to_stream():
+        with open(os.devnull, "wb") as f:
+            return download_to_stream(url, f)
+
+    elapsed, sha256 = measure(to_stream)
+    check_sha256(snapshot, sha256)
+    report("ordered stream", snapshot.size, elapsed)
+
+    server.behavior.failure_rate = 0.1
+    try:
+        elapsed, sha256 = measure(lambda: download_in_segments(url, filename))
+    finally:
+        server.behavior.failure_rate = 0
+    check_sha256(snapshot, sha256)
+    report("segmented, 10% responses cut", snapshot.size, elapsed)
+    os.remove(filename)
+
+
+# The download is interrupted once `share` of the snapshot is downloaded,
+# then it's resumed from the partial file
+def bench_resume(server, directory, share=0.5):
+    snapshot = server.snapshot
+    url = server.base_url + "/marigold/snapshots/mainnet.rolling"
+    filename = os.path.join(directory, "resume.snapshot")
+    remote = get_remote_file(url)
+
+    download = SegmentedDownload(remote, filename, sha256=snapshot.sha256)
+
+    def interrupt():
+        while download.hasher is None or download.downloaded() < share * remote.size:
+            time.sleep(0.01)
+        download.errors.append(InterruptedError("interrupted by the benchmark"))
+
+    threading.Thread(target=interrupt, daemon=True).start()
+    try:
+        download.run()
+    except urllib.error.URLError:
+        pass
+    if not os.path.exists(filename + MANIFEST_SUFFIX):
+        raise RuntimeError("The interrupted download didn't leave the manifest")
+
+    resumed = SegmentedDownload(remote, filename, sha256=snapshot.sha256)
+    elapsed, sha256 = measure(lambda: resumed.run(resume=True))
+    check_sha256(snapshot, sha256)
+    print(
+        f"{'resumed after ' + str(int(share * 100)) + '%':>36}: {elapsed:7.2f} s "
+        f"{throughput(snapshot.size, elapsed)} of the whole snapshot"
+    )
+    os.remove(filename)
+
+
+def bench_hash(server):
+    snapshot = server.snapshot
+
+    def sha256_file():
+        sha256 = hashlib.sha256()
+        with open(snapshot.path, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    elapsed, sha256 = measure(sha256_file)
+    check_sha256(snapshot, sha256)
+    report("sha256 of the file", snapshot.size, elapsed)
+
+
+def bench_provider_selection(server, artifacts):
+    rates = {"eu": 20 * 1024**2, "us": 80 * 1024**2, "asia": 5 * 1024**2}
+    server.behavior.region_rates = rates
+    try:
+        tzinit = TzInit("tzinit", server.tzinit_url)
+        elapsed, region = measure(
+            lambda: tzinit.find_fastest_region("mainnet", "rolling")
+        )
+    finally:
+        server.behavior.region_rates = {}
+    fastest = max(rates, key=rates.get)
+    if region != fastest:
+        raise RuntimeError(f"Chose the {region} region instead of {fastest}")
+    print(f"{'TzInit region':>36}: {elapsed:7.2f} s")
+
+    elapsed, _ = measure(
+        lambda: tzinit.get_snapshot_metadata("mainnet", "rolling", region)
+    )
+    print(f"{'TzInit metadata':>36}: {elapsed:7.2f} s")
+
+    server.listing.extend(mk_listing(artifacts))
+    node_version = (22, 0, None)
+    for name, ttl in [("fetched", 0), ("revalidated", 0), ("cached", float("inf"))]:
+        provider = Marigold("marigold.dev", server.marigold_url)
+
+        def select():
+            snapshot_array = get_json_cached(provider.metadata_url, ttl=ttl)["data"]
+            return provider.extract_relevant_snapshot(
+                snapshot_array, "mainnet", "rolling", node_version
+            )
+
+        elapsed, snapshot = measure(select)
+        if snapshot is None:
+            raise RuntimeError("Couldn't select the Marigold snapshot")
+        print(f"{'Marigold listing ' + name:>36}: {elapsed:7.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--size",
+        type=parse_rate_limit,
+        default=512 * 1024**2,
+        help="Size of the synthetic snapshot, e.g. '1G'.",
+    )
+    parser.add_argument(
+        "--rate",
+        type=parse_rate_limit,
+        default=None,
+        help="Bytes per second of every response of the stand-in provider.",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0, help="Delay of every response."
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        nargs="+",
+        default=[1, 4, DEFAULT_CONNECTIONS],
+    )
+    parser.add_argument(
+        "--artifacts",
+        type=int,
+        default=10_000,
+        help="Number of the additional artifacts in the Marigold listing.",
+    )
+    args = parser.parse_args()
+
+    downloader.show_download_progress = False
+    directory = tempfile.mkdtemp(prefix="tezos-benchmark-")
+    snapshot = mk_snapshot_file(os.path.join(directory, "snapshot"), args.size)
+    server = ProviderServer(
+        snapshot, behavior=Behavior(rate=args.rate, latency=args.latency)
+    ).start()
+
+    print(f"Snapshot of {args.size} bytes served at {server.base_url}")
+    print("Download:")
+    bench_download(server, directory, args.connections)
+    print("Resume:")
+    bench_resume(server, directory)
+    print("Hash:")
+    bench_hash(server)
+    print("Provider selection:")
+    bench_provider_selection(server, args.artifacts)
+
+    server.shutdown()
+    os.remove(snapshot.path)
+    os.rmdir(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2025 Oxhead Alpha
+# SPDX-License-Identifier: LicenseRef-MIT-OA
+
+"""
+Measures the snapshot selection time over a synthetic providers' listing.
+
+Run from the 'baking' directory:
+    PYTHONPATH=src python3 benchmarks/snapshot_selection.py
+"""
+
+import argparse
+import random
+import time
+
+from tezos_baking.provider import Marigold
+
+networks = ["mainnet", "ghostnet", "rionet", "quebecnet"]
+history_modes = ["rolling", "full", "archive"]
+
+
+def mk_artifact(rng, block_height):
+    rc = rng.choice([None, None, None, 1, 2])
+    artifact = {
+        "artifact_type": rng.choice(["tezos-snapshot"] * 9 + ["tarball"]),
+        "chain_name": rng.choice(networks),
+        "history_mode": rng.choice(history_modes),
+        "block_height": block_height,
+        "url": f"https://example.com/{block_height}.rolling",
+        "sha256": "0" * 64,
+        "tezos_version": {
+            "version": {
+                "major": rng.randint(18, 22),
+                "minor": rng.randint(0, 2),
+                "additional_info": "release" if rc is None else {"rc": rc},
+            }
+        },
+    }
+    if rng.random() < 0.7:
+        artifact["snapshot_version"] = rng.randint(4, 8)
+    return artifact
+
+
+def mk_listing(size, seed=0):
+    rng = random.Random(seed)
+    return [mk_artifact(rng, rng.randint(1, 10**7)) for _ in range(size)]
+
+
+def measure(f, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--artifacts", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    listing = mk_listing(args.artifacts)
+    node_version = (22, 1, None)
+
+    print(f"Selecting snapshots from {args.artifacts} artifacts")
+    for history_mode in history_modes:
+        # a fresh provider indexes the listing from scratch every time
+        cold = measure(
+            lambda: Marigold("bench", "").extract_relevant_snapshot(
+                listing, "mainnet", history_mode, node_version
+            ),
+            args.repeat,
+        )
+        provider = Marigold("bench", "")
+        warm = measure(
+            lambda: provider.extract_relevant_snapshot(
+                listing, "mainnet", history_mode, node_version
+            ),
+            args.repeat,
+        )
+        print(
+            f"{history_mode:>8}: {cold * 1000:8.1f} ms with indexing, "
+            f"{warm * 1000:8.1f} ms with the index reused"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+# SPDX-FileCopyrightText: 2025 Oxhead Alpha
+# SPDX-License-Identifier: LicenseRef-MIT-OA
+
+"""
+Contains detection and multi-threaded decompression of the compressed snapshots
+"""
+
+import os
+import re
+import shlex
+import hashlib
+import logging
+import threading
+import subprocess
+import urllib.request
+from urllib.parse import urlparse
+from dataclasses import dataclass
+from typing import List
+
+from tezos_baking.util import *
+from tezos_baking.downloader import CHUNK_SIZE, REQUEST_TIMEOUT
+from tezos_baking.progress import PhaseProgress
+
+
+@dataclass
+class Compression:
+    name: str
+    magic: bytes
+    suffixes: List[str]
+    # reads the compressed data from stdin and writes it decompressed to stdout,
+    # '-T0' lets the tools use all the cores
+    decompress_cmd: str
+    # lists the sizes of the compressed file given as the argument
+    list_cmd: str
+    # matches the decompressed size in the output of `list_cmd`
+    decompressed_size_regex: str
+
+
+compressions = [
+    Compression(
+        "zstd",
+        b"\x28\xb5\x2f\xfd",
+        [".zst", ".zstd"],
+        "zstd -d -c -q -T0",
+        "zstd -l -v",
+        r"Decompressed Size: .*\((\d+) B\)",
+    ),
+    Compression(
+        "xz",
+        b"\xfd\x37\x7a\x58\x5a\x00",
+        [".xz"],
+        "xz -d -c -q -T0",
+        "xz --robot --list",
+        r"^totals\t\d+\t\d+\t\d+\t(\d+)",
+    ),
+]
+
+magic_size = max(len(compression.magic) for compression in compressions)
+# The decompressed snapshots are assumed to be at most this many times bigger
+# than the compressed ones when their size can't be known
+decompression_ratio = 3
+
+
+# Detects the compression by the first bytes of the file, or by
+# the suffix of its name if they aren't known
+def detect_compression(head=None, name=None):
+    for compression in compressions:
+        if head is not None:
+            if head.startswith(compression.magic):
+                return compression
+        elif name is not None:
+            if any(name.endswith(suffix) for suffix in compression.suffixes):
+                return compression
+    return None
+
+
+def detect_file_compression(filename):
+    with open(filename, "rb") as f:
+        return detect_compression(head=f.read(magic_size))
+
+
+def detect_remote_compression(url):
+    request = urllib.request.Request(
+        url, headers={**http_request_headers, "Range": f"bytes=0-{magic_size - 1}"}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+            head = response.read(magic_size)
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        logging.warning(f"Couldn't read the beginning of {url}: {e}")
+        head = None
+    return detect_compression(head, urlparse(url).path)
+
+
+def estimate_decompressed_size(compressed_size):
+    return compressed_size * decompression_ratio
+
+
+# Returns the size of the decompressed file, it's estimated if the size
+# isn't recorded in the file, e.g. when it was compressed from a pipe
+def get_decompressed_size(filename, compression):
+    try:
+        result = subprocess.run(
+            shlex.split(compression.list_cmd) + [filename],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            check=True,
+        )
+        match = re.search(
+            compression.decompressed_size_regex, result.stdout.decode(), re.MULTILINE
+        )
+        if match is not None:
+            return int(match.group(1))
+    except (OSError, subprocess.CalledProcessError) as e:
+        logging.warning(f"Couldn't list the sizes of {filename}: {e}")
+    return estimate_decompressed_size(os.path.getsize(filename))
+
+
+# Runs the decompressor, the decompressed data is passed to `output`
+# with its SHA256 computed on the way
+class Decompressor:
+    def __init__(self, compression, output):
+        self.compression = compression
+        self.output = output
+        self.sha256 = hashlib.sha256()
+        self.process = subprocess.Popen(
+            shlex.split(compression.decompress_cmd),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            while chunk := self.process.stdout.read(CHUNK_SIZE):
+                self.output.write(chunk)
+                self.sha256.update(chunk)
+        except BaseException as e:
+            self.error = e
+            self.process.kill()
+
+    def write(self, data):
+        if self.error is not None:
+            raise self.error
+        self.process.stdin.write(data)
+
+    # Waits for all the data to be decompressed, returns its SHA256
+    def finish(self):
+        self.process.stdin.close()
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        if self.process.wait() != 0:
+            raise ValueError(f"Couldn't decompress the {self.compression.name} data")
+        return self.sha256.hexdigest()
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        self.thread.join()
+
+
+# Returns SHA256 of the compressed and the decompressed data
+def decompress_file(filename, output_filename, compression):
+    logging.info(f"Decompressing {filename} with {compression.name}")
+    compressed_sha256 = hashlib.sha256()
+    progress = PhaseProgress(
+        "decompress", os.path.getsize(filename), compression=compression.name
+    )
+    with open(filename, "rb") as input, open(output_filename, "wb") as output:
+        decompressor = Decompressor(compression, output)
+        try:
+            while chunk := input.read(CHUNK_SIZE):
+                compressed_sha256.update(chunk)
+                decompressor.write(chunk)
+                progress.update(input.tell())
+            decompressed_sha256 = decompressor.finish()
+        except BrokenPipeError:
+            # the decompressor stopped on the invalid data
+            decompressor.stop()
+            progress.fail("Invalid compressed data")
+            raise ValueError(f"Couldn't decompress the {compression.name} data")
+        except BaseException as e:
+            decompressor.stop()
+            progress.fail(e)
+            raise
+    progress.finish()
+    return (compressed_sha256.hexdigest(), decompressed_sha256)
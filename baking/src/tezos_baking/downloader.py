@@ -0,0 +1,920 @@
+# SPDX-FileCopyrightText: 2025 Oxhead Alpha
+# SPDX-License-Identifier: LicenseRef-MIT-OA
+
+"""
+Contains parallel HTTP range downloader used to fetch node snapshots
+"""
+
+import os
+import re
+import copy
+import json
+import hashlib
+import time
+import logging
+import threading
+import http.client
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from queue import Queue, Empty
+from typing import List, Optional
+from urllib.parse import urlparse
+
+from tezos_baking.util import *
+from tezos_baking.progress import *
+
+# Size of the byte range requested from the server at once,
+# every such block has its own checksum in the manifest
+SEGMENT_SIZE = 64 * 1024 * 1024
+# Size of the byte range requested at once when the file is streamed
+STREAM_BLOCK_SIZE = 16 * 1024 * 1024
+# Size of the buffer used to read the response body
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_CONNECTIONS = 8
+# Number of consecutive failures after which the segment download is given up
+MAX_RETRIES = 5
+REQUEST_TIMEOUT = 30
+# Suffix of the file that stores checksums of the downloaded blocks
+MANIFEST_SUFFIX = ".manifest"
+# Number of the first bytes of the file fetched to measure the throughput
+PROBE_SAMPLE_SIZE = 4 * 1024 * 1024
+PROBE_TIMEOUT = 10
+# A mirror stops getting new segments once its per-connection throughput
+# is below this share of the fastest one
+SLOW_SOURCE_SHARE = 0.25
+
+
+# The adaptive rate limit starts at the share of the throughput measured
+# during the first seconds of the download. Then it's checked periodically:
+# it's halved when the download can't reach it, e.g. since the link is
+# busy with other traffic, and otherwise it grows back by a step.
+ADAPTIVE_RATE_SHARE = 0.5
+ADAPTIVE_PROBE_TIME = 10
+# Share of the limit below which the download is considered congested
+ADAPTIVE_CONGESTION_SHARE = 0.8
+# Shares of the initial limit, by which the limit grows and below which it
+# isn't lowered. It isn't raised above the initial limit.
+ADAPTIVE_INCREASE_SHARE = 0.1
+ADAPTIVE_MIN_SHARE = 0.1
+
+rate_suffixes = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+
+
+# Parses the rate limit given either as bytes per second with an optional
+# K, M or G suffix, e.g. '20M', or as 'adaptive'. Returns None for no limit.
+def parse_rate_limit(value):
+    normalized = value.strip().upper()
+    if normalized in ["", "0", "NONE"]:
+        return None
+    if normalized == "ADAPTIVE":
+        return "adaptive"
+    match = re.fullmatch(r"([0-9]+(?:\.[0-9]+)?)([KMG]?)(?:I?B)?(?:/S)?", normalized)
+    if match is None:
+        raise ValueError(f"Invalid rate limit: {value}")
+    return int(float(match.group(1)) * rate_suffixes[match.group(2)])
+
+
+# Token bucket shared by all the download connections
+class RateLimiter:
+    def __init__(self, rate="adaptive"):
+        self.adaptive = rate == "adaptive"
+        # in bytes per second, unknown until measured when adaptive
+        self.rate = None if self.adaptive else rate
+        self.initial_rate = None
+        self.lock = threading.Lock()
+        # the throughput is measured over the periods of ADAPTIVE_PROBE_TIME
+        self.started_at = None
+        self.measured = 0
+        self.tokens = 0
+        self.updated_at = time.monotonic()
+
+    def adjust(self, throughput):
+        if self.rate is None:
+            self.initial_rate = max(int(ADAPTIVE_RATE_SHARE * throughput), 1)
+            return self.initial_rate
+        if throughput < ADAPTIVE_CONGESTION_SHARE * self.rate:
+            return max(self.rate // 2, int(ADAPTIVE_MIN_SHARE * self.initial_rate), 1)
+        step = max(int(ADAPTIVE_INCREASE_SHARE * self.initial_rate), 1)
+        return min(self.rate + step, self.initial_rate)
+
+    def measure(self, amount, now):
+        if self.started_at is None:
+            self.started_at = now
+        self.measured += amount
+        elapsed = now - self.started_at
+        if elapsed >= ADAPTIVE_PROBE_TIME:
+            rate = self.adjust(self.measured / elapsed)
+            if rate != self.rate:
+                logging.info(f"Limiting the download rate to {rate} B/s")
+            if self.rate is None:
+                self.updated_at = now
+            self.rate = rate
+            self.started_at, self.measured = now, 0
+
+    # Blocks the caller until `amount` bytes may be received
+    def consume(self, amount):
+        with self.lock:
+            now = time.monotonic()
+            if self.adaptive:
+                unlimited = self.rate is None
+                self.measure(amount, now)
+                if unlimited:
+                    return
+            # at most one second of the unused rate is accumulated
+            self.tokens = min(
+                self.rate, self.tokens + (now - self.updated_at) * self.rate
+            )
+            self.updated_at = now
+            self.tokens -= amount
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        time.sleep(delay)
+
+
+download_rate_limiter = None
+
+
+def set_download_rate_limit(rate):
+    global download_rate_limiter
+    download_rate_limiter = None if rate is None else RateLimiter(rate)
+
+
+def throttle(amount):
+    if download_rate_limiter is not None:
+        download_rate_limiter.consume(amount)
+
+
+class RangesNotSupported(Exception):
+    "Raised when the server doesn't allow to fetch the file by byte ranges."
+
+
+# The results of the checks are shared with the validation of the urls,
+# the downloader gets its own copy of the file info
+def get_remote_file(url, timeout=REQUEST_TIMEOUT):
+    return copy.copy(check_url(url, timeout))
+
+
+# Measures the download throughput on the first bytes of the file.
+# Returns the throughput in bytes per second along with the file info,
+# the size is known only if the server reports it.
+def probe_download(url, sample_size=PROBE_SAMPLE_SIZE, timeout=PROBE_TIMEOUT):
+    request = urllib.request.Request(
+        url, headers={**http_request_headers, "Range": f"bytes=0-{sample_size - 1}"}
+    )
+    start = time.monotonic()
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        received = len(response.read(sample_size))
+        elapsed = max(time.monotonic() - start, 1e-3)
+        remote = mk_remote_file(response)
+        # the file is fetched by byte ranges only if the server has sent the range
+        remote.accept_ranges = response.status == 206
+    return (received / elapsed, remote)
+
+
+# Keeps idle keep-alive connections to the single host, so that
+# consecutive range requests don't pay for TCP/TLS handshake again
+class ConnectionPool:
+    def __init__(self, url, timeout=REQUEST_TIMEOUT):
+        parsed = urlparse(url)
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.path = parsed.path + ("?" + parsed.query if parsed.query else "")
+        self.timeout = timeout
+        self.idle = Queue()
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except Empty:
+            if self.scheme == "https":
+                return http.client.HTTPSConnection(
+                    self.host, self.port, timeout=self.timeout
+                )
+            return http.client.HTTPConnection(
+                self.host, self.port, timeout=self.timeout
+            )
+
+    def release(self, connection, reusable=True):
+        if reusable:
+            self.idle.put(connection)
+        else:
+            connection.close()
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except Empty:
+                return
+
+
+# One of the servers that hold the same file, they are all downloaded
+# from at once. Every source has its own connections, so the faster ones
+# take more segments from the shared queue.
+class Source:
+    def __init__(self, remote: RemoteFile):
+        self.remote = remote
+        self.host = urlparse(remote.url).netloc
+        self.pool = ConnectionPool(remote.url)
+        self.lock = threading.Lock()
+        self.received = 0
+        # time spent by all the connections of the source on receiving
+        self.busy = 0.0
+        # consecutive failed requests over all the connections
+        self.failures = 0
+        self.retired = False
+
+    def record(self, amount, elapsed):
+        with self.lock:
+            self.received += amount
+            self.busy += elapsed
+            self.failures = 0
+
+    def failed(self):
+        with self.lock:
+            self.failures += 1
+            return self.failures
+
+    # Bytes per second per connection, None until `sample` bytes are received
+    def rate(self, sample):
+        with self.lock:
+            if self.received < sample or self.busy == 0:
+                return None
+            return self.received / self.busy
+
+    def stats(self):
+        return {
+            "url": self.remote.url,
+            "bytes": self.received,
+            # per connection
+            "rate": None if (rate := self.rate(0)) is None else round(rate),
+            "retired": self.retired,
+        }
+
+
+@dataclass
+class Segment:
+    start: int
+    # exclusive
+    end: int
+    # number of bytes of the segment that are already on disk
+    done: int = 0
+    # SHA256 of the fully downloaded segment
+    digest: Optional[str] = None
+
+    def __post_init__(self):
+        self.sha256 = hashlib.sha256()
+
+    def remaining(self):
+        return self.end - self.start - self.done
+
+    def complete(self, digest):
+        self.done = self.end - self.start
+        self.digest = digest
+
+    def next_range(self):
+        return f"bytes={self.start + self.done}-{self.end - 1}"
+
+
+# Computes SHA256 of the file while it's being downloaded.
+# Segments are written out of order, so the hash follows the contiguous
+# prefix of the file: the chunks are hashed right after they're written
+# when they extend the prefix, or once the gap before them is filled.
+class StreamingSha256:
+    def __init__(self, filename):
+        self.filename = filename
+        self.sha256 = hashlib.sha256()
+        self.position = 0
+        # start -> end of the written but not yet hashed ranges
+        self.pending = {}
+        self.closed = False
+        self.stopped = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def written(self, offset, length):
+        if length == 0:
+            return
+        with self.condition:
+            self.pending[offset] = offset + length
+            self.condition.notify()
+
+    def run(self):
+        fd = os.open(self.filename, os.O_RDONLY)
+        try:
+            while True:
+                with self.condition:
+                    while self.position not in self.pending and not self.closed:
+                        self.condition.wait()
+                    if self.position not in self.pending:
+                        return
+                    end = self.pending.pop(self.position)
+                # freshly written data is read back from the page cache
+                while self.position < end and not self.stopped:
+                    chunk = os.pread(
+                        fd, min(CHUNK_SIZE, end - self.position), self.position
+                    )
+                    if not chunk:
+                        return
+                    self.sha256.update(chunk)
+                    self.position += len(chunk)
+        finally:
+            os.close(fd)
+
+    # Abandons hashing of the pending data
+    def stop(self):
+        with self.condition:
+            self.stopped = self.closed = True
+            self.pending.clear()
+            self.condition.notify()
+
+    # Waits for the pending data to be hashed, returns None if the
+    # hashed prefix doesn't cover the whole file
+    def hexdigest(self, size):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        return self.sha256.hexdigest() if self.position == size else None
+
+
+# Digests computed during the download, so that the integrity check
+# doesn't need to read the file again.
+# Filename -> (size, mtime, sha256)
+streamed_sha256 = {}
+
+# Digests of the compressed files the snapshots were decompressed from
+compressed_digests = {}
+
+
+def record_streamed_sha256(filename, sha256, digests=streamed_sha256):
+    stat = os.stat(filename)
+    digests[os.path.realpath(filename)] = (
+        stat.st_size,
+        stat.st_mtime_ns,
+        sha256,
+    )
+
+
+# Returns the digest computed during the download, if the file
+# wasn't changed since then
+def get_streamed_sha256(filename, digests=streamed_sha256):
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    size, mtime, sha256 = digests.get(os.path.realpath(filename), (None, None, None))
+    if size == stat.st_size and mtime == stat.st_mtime_ns:
+        return sha256
+    return None
+
+
+# Disabled when several downloads run at once, e.g. by tezos-bootstrap
+show_download_progress = True
+
+
+def show_progress(done, total, started_at, initial=0):
+    if not show_download_progress:
+        return
+    elapsed = max(time.time() - started_at, 1e-3)
+    speed = (done - initial) / elapsed
+    eta = ""
+    if total and speed > 0:
+        eta = f", ETA {format_duration((total - done) / speed)}"
+    print(
+        "Progress:",
+        f"{int(done * 100 / total)} %," if total else "",
+        int(done / (1024 * 1024)),
+        "MB,",
+        round(speed / (1024 * 1024), 1),
+        f"MB/s{eta}",
+        end="\r",
+    )
+
+
+def split_into_segments(size, segment_size=SEGMENT_SIZE):
+    return [
+        Segment(start, min(start + segment_size, size))
+        for start in range(0, size, segment_size)
+    ]
+
+
+class SegmentedDownload:
+    def __init__(
+        self,
+        remote: RemoteFile,
+        filename,
+        connections=DEFAULT_CONNECTIONS,
+        segment_size=SEGMENT_SIZE,
+        sha256=None,
+        mirrors: Optional[List[RemoteFile]] = None,
+    ):
+        self.remote = remote
+        self.filename = filename
+        self.manifest_file = filename + MANIFEST_SUFFIX
+        # expected SHA256 of the whole file, if known
+        self.sha256 = sha256
+        self.connections = connections
+        self.segment_size = segment_size
+        self.segments: List[Segment] = []
+        self.sources = [Source(remote)] + [Source(mirror) for mirror in mirrors or []]
+        # guards the segment queue together with the number of segments
+        # taken from it, so that workers don't quit while a retired source
+        # may still put its segment back
+        self.queue_lock = threading.Lock()
+        self.in_flight = 0
+        self.errors = []
+        self.hasher = None
+
+    # Properties that tell whether the partial file and the remote file
+    # are the same snapshot
+    def identity(self):
+        return {
+            "url": self.remote.url,
+            "size": self.remote.size,
+            "etag": self.remote.etag,
+            "last_modified": self.remote.last_modified,
+            "sha256": self.sha256,
+        }
+
+    # The blocks of the partial file can be reused only if it's known that
+    # the remote file didn't change, either from the expected sha256 or
+    # from the HTTP validators
+    def can_resume(self, manifest):
+        identity = self.identity()
+        if any(manifest.get(key) != value for key, value in identity.items()):
+            return False
+        return any(
+            identity[key] is not None for key in ["sha256", "etag", "last_modified"]
+        )
+
+    # Restores the blocks downloaded during the previous attempts.
+    # Every block is checked against its recorded checksum, so the
+    # corrupted ones are downloaded again.
+    # The intact prefix of the file is fed to the whole file hasher
+    # on the way, so that it isn't read twice.
+    # Returns whether the partial file belongs to the same remote file.
+    def load_manifest(self):
+        try:
+            with open(self.manifest_file, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if not self.can_resume(manifest) or not os.path.exists(self.filename):
+            return False
+        if manifest.get("block_size") != self.segment_size:
+            return False
+        if os.path.getsize(self.filename) != self.remote.size:
+            return False
+
+        print("Checking the blocks of the partially downloaded snapshot...")
+        logging.info("Checking the blocks of the partially downloaded snapshot")
+        self.segments = split_into_segments(self.remote.size, self.segment_size)
+        digests = manifest.get("blocks", [])
+        prefix = True
+        with open(self.filename, "rb") as f:
+            for segment, digest in zip(self.segments, digests):
+                if digest is None:
+                    prefix = False
+                    continue
+                f.seek(segment.start)
+                block_sha256 = hashlib.sha256()
+                # rolled back in case the block is corrupted
+                file_sha256 = self.hasher.sha256.copy()
+                to_read = segment.end - segment.start
+                while to_read > 0:
+                    chunk = f.read(min(CHUNK_SIZE, to_read))
+                    if not chunk:
+                        break
+                    block_sha256.update(chunk)
+                    if prefix:
+                        file_sha256.update(chunk)
+                    to_read -= len(chunk)
+                if block_sha256.hexdigest() == digest:
+                    segment.complete(digest)
+                    if prefix:
+                        self.hasher.sha256 = file_sha256
+                        self.hasher.position = segment.end
+                    else:
+                        self.hasher.written(segment.start, segment.done)
+                else:
+                    logging.warning(f"Block at {segment.start} is corrupted")
+                    prefix = False
+        intact = sum(segment.digest is not None for segment in self.segments)
+        print(f"{intact} of {len(self.segments)} blocks are intact.")
+        logging.info(f"{intact} of {len(self.segments)} blocks are intact")
+        return True
+
+    def dump_manifest(self):
+        manifest = {
+            **self.identity(),
+            "block_size": self.segment_size,
+            "blocks": [segment.digest for segment in self.segments],
+        }
+        with open(self.manifest_file + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(self.manifest_file + ".tmp", self.manifest_file)
+
+    def remove_manifest(self):
+        try:
+            os.remove(self.manifest_file)
+        except FileNotFoundError:
+            pass
+
+    def downloaded(self):
+        return sum(segment.done for segment in self.segments)
+
+    def fetch_segment(self, fd, segment, source):
+        connection = source.pool.acquire()
+        reusable = False
+        try:
+            started_at = time.time()
+            connection.request(
+                "GET",
+                source.pool.path,
+                headers={**http_request_headers, "Range": segment.next_range()},
+            )
+            response = connection.getresponse()
+            if response.status != 206:
+                # the body, possibly the whole file, isn't read,
+                # the connection is closed instead
+                response.close()
+                # the server errors are retried, unlike the full responses
+                if response.status >= 500 or response.status == 429:
+                    raise http.client.HTTPException(
+                        f"{response.status} {response.reason}"
+                    )
+                raise RangesNotSupported
+            while not self.errors:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                throttle(len(chunk))
+                offset = segment.start + segment.done
+                os.pwrite(fd, chunk, offset)
+                segment.sha256.update(chunk)
+                segment.done += len(chunk)
+                self.hasher.written(offset, len(chunk))
+                now = time.time()
+                source.record(len(chunk), now - started_at)
+                started_at = now
+            if segment.remaining() != 0:
+                raise http.client.IncompleteRead(b"", segment.remaining())
+            segment.digest = segment.sha256.hexdigest()
+            reusable = not response.will_close
+        finally:
+            source.pool.release(connection, reusable)
+
+    def active_sources(self):
+        return [source for source in self.sources if not source.retired]
+
+    # Returns the next segment to fetch, or None once all the segments
+    # are fetched or being fetched by the sources that aren't retired
+    def take_segment(self, queue):
+        while not self.errors:
+            with self.queue_lock:
+                try:
+                    segment = queue.get_nowait()
+                    self.in_flight += 1
+                    return segment
+                except Empty:
+                    if self.in_flight == 0:
+                        return None
+            time.sleep(1)
+        return None
+
+    def return_segment(self, queue, segment):
+        with self.queue_lock:
+            if segment.remaining() > 0:
+                queue.put(segment)
+            self.in_flight -= 1
+
+    # Stops fetching from the source, its work goes to the other sources.
+    # Returns False if it's the last source left.
+    def retire(self, source, reason):
+        with self.queue_lock:
+            if source.retired:
+                return True
+            if len(self.active_sources()) <= 1:
+                return False
+            source.retired = True
+        logging.warning(f"Not downloading from {source.host} anymore: {reason}")
+        emit_event("retire", "download", source=source.stats(), reason=reason)
+        return True
+
+    def is_slow(self, source):
+        rates = [
+            rate
+            for other in self.active_sources()
+            if (rate := other.rate(self.segment_size)) is not None
+        ]
+        rate = source.rate(self.segment_size)
+        # there is nothing to compare with before the other rates are known
+        if rate is None or not rates:
+            return False
+        return rate < SLOW_SOURCE_SHARE * max(rates)
+
+    def worker(self, fd, queue, source):
+        while not self.errors and not source.retired:
+            segment = self.take_segment(queue)
+            if segment is None:
+                return
+            try:
+                self.fetch_with_retries(fd, segment, source)
+            finally:
+                self.return_segment(queue, segment)
+            if not source.retired and self.is_slow(source):
+                self.retire(source, "it's too slow")
+
+    def fetch_with_retries(self, fd, segment, source):
+        failures = 0
+        while segment.remaining() > 0 and not self.errors and not source.retired:
+            done = segment.done
+            try:
+                self.fetch_segment(fd, segment, source)
+            except RangesNotSupported as e:
+                if not self.retire(source, "it doesn't support range requests"):
+                    self.errors.append(e)
+                return
+            except (OSError, http.client.HTTPException) as e:
+                # the failure counter is reset once the segment progresses
+                failures = 0 if segment.done > done else failures + 1
+                logging.warning(
+                    f"Failed to fetch {segment.next_range()} from {source.host}: {e}"
+                )
+                if len(self.active_sources()) > 1:
+                    # the segment is handed over to the other sources
+                    # instead of waiting for this one to recover
+                    if source.failed() >= MAX_RETRIES:
+                        self.retire(source, str(e))
+                    return
+                if failures >= MAX_RETRIES:
+                    self.errors.append(e)
+                    return
+                time.sleep(failures)
+
+    # Returns SHA256 of the downloaded file
+    def run(self, resume=False):
+        self.hasher = StreamingSha256(self.filename)
+        if not (resume and self.load_manifest()):
+            logging.info("Starting segmented download from scratch")
+            self.segments = split_into_segments(self.remote.size, self.segment_size)
+            with open(self.filename, "wb"):
+                pass
+        else:
+            logging.info(f"Resuming segmented download, {self.downloaded()} bytes done")
+
+        self.hasher.start()
+        queue = Queue()
+        for segment in self.segments:
+            if segment.remaining() > 0:
+                queue.put(segment)
+
+        fd = os.open(self.filename, os.O_WRONLY)
+        workers = [
+            threading.Thread(target=self.worker, args=(fd, queue, source), daemon=True)
+            # interleaved, so that the first segments are spread over the sources
+            for _ in range(min(self.connections, max(queue.qsize(), 1)))
+            for source in self.sources
+        ]
+        started_at, initial = time.time(), self.downloaded()
+        progress = PhaseProgress(
+            "download",
+            self.remote.size,
+            initial,
+            sources=[source.remote.url for source in self.sources],
+        )
+        try:
+            os.ftruncate(fd, self.remote.size)
+            for worker in workers:
+                worker.start()
+            while True:
+                alive = [worker for worker in workers if worker.is_alive()]
+                if not alive:
+                    break
+                alive[0].join(timeout=1)
+                self.dump_manifest()
+                show_progress(self.downloaded(), self.remote.size, started_at, initial)
+                progress.update(self.downloaded())
+        except BaseException as e:
+            self.errors.append(e)
+            self.hasher.stop()
+            progress.fail(e)
+            raise
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.join(timeout=1)
+            # workers blocked on the network may still write to the file
+            if not any(worker.is_alive() for worker in workers):
+                os.close(fd)
+            for source in self.sources:
+                source.pool.close()
+            self.dump_manifest()
+            if len(self.sources) > 1:
+                for source in self.sources:
+                    logging.info(f"Got {source.received} bytes from {source.host}")
+
+        if self.errors:
+            self.hasher.stop()
+            error = self.errors[0]
+            progress.fail(error)
+            if isinstance(error, RangesNotSupported):
+                raise error
+            raise urllib.error.URLError(error)
+
+        # a worker may have stopped without recording its error, then
+        # the manifest is kept, so that the download can be resumed
+        missing = sum(segment.remaining() for segment in self.segments)
+        if missing:
+            self.hasher.stop()
+            error = http.client.IncompleteRead(b"", missing)
+            progress.fail(error)
+            raise urllib.error.URLError(error)
+        sha256 = self.hasher.hexdigest(self.remote.size)
+        if sha256 is None:
+            error = urllib.error.URLError("The downloaded file wasn't hashed entirely")
+            progress.fail(error)
+            raise error
+
+        self.remove_manifest()
+        progress.finish(sources=[source.stats() for source in self.sources])
+        return sha256
+
+
+# Downloads the file from the `url` over several connections
+# in parallel, each fetching its own range of bytes.
+# The ranges are also fetched from the `mirrors` of the same size.
+# Raises `RangesNotSupported` if the server doesn't allow this.
+# With `resume`, the intact blocks of the existing partial file are reused.
+# Returns SHA256 of the file computed during the download.
+def download_in_segments(
+    url,
+    filename,
+    resume=False,
+    connections=DEFAULT_CONNECTIONS,
+    remote=None,
+    sha256=None,
+    mirrors=None,
+):
+    remote = get_remote_file(url) if remote is None else remote
+    if not remote.accept_ranges or not remote.size:
+        raise RangesNotSupported
+    mirrors = [
+        mirror
+        for mirror in mirrors or []
+        if mirror.accept_ranges and mirror.size == remote.size
+    ]
+    sha256 = SegmentedDownload(
+        remote, filename, connections, sha256=sha256, mirrors=mirrors
+    ).run(resume)
+    if sha256 is not None:
+        record_streamed_sha256(filename, sha256)
+    return sha256
+
+
+# Downloads the file by byte ranges in parallel, but writes it to
+# the `output` strictly in order, so that it can be consumed as a stream,
+# e.g. through a pipe. At most `window` blocks are kept in memory.
+class OrderedDownload:
+    def __init__(
+        self,
+        remote: RemoteFile,
+        connections=DEFAULT_CONNECTIONS,
+        block_size=STREAM_BLOCK_SIZE,
+    ):
+        self.remote = remote
+        self.connections = connections
+        self.block_size = block_size
+        self.window = 2 * connections
+        self.pool = ConnectionPool(remote.url)
+        self.cancelled = False
+
+    def fetch_block(self, start, end):
+        block = bytearray()
+        failures = 0
+        while not self.cancelled:
+            connection = self.pool.acquire()
+            reusable = False
+            try:
+                connection.request(
+                    "GET",
+                    self.pool.path,
+                    headers={
+                        **http_request_headers,
+                        "Range": f"bytes={start + len(block)}-{end - 1}",
+                    },
+                )
+                response = connection.getresponse()
+                if response.status != 206:
+                    # the body isn't read, the connection is closed instead
+                    response.close()
+                    if response.status >= 500 or response.status == 429:
+                        raise http.client.HTTPException(
+                            f"{response.status} {response.reason}"
+                        )
+                    raise RangesNotSupported
+                received = len(block)
+                while not self.cancelled:
+                    chunk = response.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    throttle(len(chunk))
+                    block += chunk
+                if len(block) == end - start:
+                    reusable = not response.will_close
+                    return bytes(block)
+                failures = 0 if len(block) > received else failures + 1
+            except (OSError, http.client.HTTPException) as e:
+                failures += 1
+                logging.warning(f"Failed to fetch bytes from {start}: {e}, retrying")
+            finally:
+                self.pool.release(connection, reusable)
+            if failures >= MAX_RETRIES:
+                raise urllib.error.URLError(f"Couldn't fetch bytes from {start}")
+            time.sleep(failures)
+        raise urllib.error.URLError("The download was cancelled")
+
+    # Returns SHA256 of the written data
+    def run(self, output):
+        sha256 = hashlib.sha256()
+        size = self.remote.size
+        blocks = [
+            (start, min(start + self.block_size, size))
+            for start in range(0, size, self.block_size)
+        ]
+        next_block, done = 0, 0
+        pending = deque()
+        started_at = time.time()
+        progress = PhaseProgress("download", size, streaming=True)
+        executor = ThreadPoolExecutor(max_workers=self.connections)
+        try:
+            while pending or next_block < len(blocks):
+                while next_block < len(blocks) and len(pending) < self.window:
+                    pending.append(
+                        executor.submit(self.fetch_block, *blocks[next_block])
+                    )
+                    next_block += 1
+                block = pending.popleft().result()
+                output.write(block)
+                sha256.update(block)
+                done += len(block)
+                show_progress(done, size, started_at)
+                progress.update(done)
+        except RangesNotSupported:
+            # the beginning of the file is already consumed by the reader
+            progress.fail("The server refused range requests")
+            raise urllib.error.URLError("The server refused range requests")
+        except BaseException as e:
+            progress.fail(e)
+            raise
+        finally:
+            self.cancelled = True
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+            self.pool.close()
+        progress.finish()
+        return sha256.hexdigest()
+
+
+def download_sequentially(url, output):
+    sha256 = hashlib.sha256()
+    request = urllib.request.Request(url, headers=http_request_headers)
+    with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+        content_length = response.headers.get("Content-Length")
+        size = int(content_length) if content_length is not None else None
+        done = 0
+        started_at = time.time()
+        progress = PhaseProgress("download", size, streaming=True)
+        while True:
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            throttle(len(chunk))
+            output.write(chunk)
+            sha256.update(chunk)
+            done += len(chunk)
+            show_progress(done, size, started_at)
+            progress.update(done)
+    progress.finish()
+    return sha256.hexdigest()
+
+
+# Writes the file from the `url` to the `output` in order without
+# storing it on disk. Returns SHA256 of the file.
+def download_to_stream(url, output, connections=DEFAULT_CONNECTIONS):
+    try:
+        remote = get_remote_file(url)
+    except (urllib.error.URLError, ValueError, OSError) as e:
+        logging.warning(f"Couldn't get the file info: {e}")
+        remote = None
+    if remote is not None and remote.accept_ranges and remote.size:
+        return OrderedDownload(remote, connections).run(output)
+    return download_sequentially(url, output)
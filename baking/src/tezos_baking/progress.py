@@ -0,0 +1,192 @@
+# SPDX-FileCopyrightText: 2025 Oxhead Alpha
+# SPDX-License-Identifier: LicenseRef-MIT-OA
+
+"""
+Contains machine-readable progress events of the snapshot download and import
+"""
+
+import os
+import time
+import json
+import socket
+import logging
+import threading
+
+# Minimal interval between the progress events of a phase, in seconds
+PROGRESS_EVENT_INTERVAL = 1
+# Timeout of sending the event over the socket, in seconds
+EVENT_SOCKET_TIMEOUT = 5
+
+
+# Writes the events as JSON lines to one of the following destinations:
+# '<path to file>', 'unix:<path to socket>', 'tcp:<host>:<port>' or 'udp:<host>:<port>'.
+# The events are best effort, the failures to send them never stop the setup.
+class EventSink:
+    def __init__(self, destination):
+        self.destination = destination
+        self.lock = threading.Lock()
+        self.socket = None
+        self.file = None
+        self.failed = False
+
+    def connect(self):
+        scheme, _, address = self.destination.partition(":")
+        if scheme == "unix":
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(address)
+        elif scheme in ["tcp", "udp"]:
+            host, _, port = address.rpartition(":")
+            kind = socket.SOCK_STREAM if scheme == "tcp" else socket.SOCK_DGRAM
+            family, kind, proto, _, sockaddr = socket.getaddrinfo(
+                host, int(port), type=kind
+            )[0]
+            self.socket = socket.socket(family, kind, proto)
+            self.socket.settimeout(EVENT_SOCKET_TIMEOUT)
+            self.socket.connect(sockaddr)
+        else:
+            self.file = open(self.destination, "a", buffering=1)
+
+    def close(self):
+        for resource in [self.file, self.socket]:
+            if resource is not None:
+                try:
+                    resource.close()
+                except OSError:
+                    pass
+        self.file, self.socket = None, None
+
+    def emit(self, event):
+        line = json.dumps(event) + "\n"
+        with self.lock:
+            try:
+                if self.file is None and self.socket is None:
+                    self.connect()
+                if self.file is not None:
+                    self.file.write(line)
+                else:
+                    # every event is sent in a separate datagram with UDP
+                    self.socket.sendall(line.encode())
+                self.failed = False
+            except (OSError, ValueError) as e:
+                # the connection is retried with the next event
+                if not self.failed:
+                    logging.warning(
+                        f"Couldn't send the progress event to {self.destination}: {e}"
+                    )
+                self.failed = True
+                self.close()
+
+
+progress_events = None
+# Fields added to every event, e.g. the network
+progress_event_context = {}
+# Durations of the phases finished by this process, in the order they've ended
+phase_timings = []
+
+
+def set_progress_events(destination, **context):
+    global progress_events
+    if progress_events is not None:
+        progress_events.close()
+    progress_events = None if not destination else EventSink(destination)
+    progress_event_context.clear()
+    progress_event_context.update(context)
+
+
+def emit_event(event, phase, **fields):
+    if progress_events is None:
+        return
+    progress_events.emit(
+        {
+            "time": round(time.time(), 3),
+            "host": socket.gethostname(),
+            "event": event,
+            "phase": phase,
+            **progress_event_context,
+            **fields,
+        }
+    )
+
+
+# Reports the progress of the phase, e.g. 'download' or 'import',
+# with the number of processed bytes, the rate in bytes per second and
+# the ETA in seconds. When the amount of processed data isn't known,
+# the ETA is estimated from the `expected_rate` instead.
+class PhaseProgress:
+    def __init__(self, phase, total=None, initial=0, expected_rate=None, **fields):
+        self.phase = phase
+        self.total = total
+        self.initial = initial
+        self.done = initial
+        self.expected_rate = expected_rate
+        self.fields = fields
+        self.started_at = time.time()
+        self.reported_at = self.started_at
+        emit_event("start", phase, total=total, done=initial, **fields)
+
+    def stats(self):
+        elapsed = max(time.time() - self.started_at, 1e-3)
+        if self.done is None:
+            rate = None
+            eta = None
+            if self.total and self.expected_rate:
+                eta = max(self.total / self.expected_rate - elapsed, 0)
+        else:
+            rate = (self.done - self.initial) / elapsed
+            eta = (self.total - self.done) / rate if self.total and rate > 0 else None
+        return {
+            "done": self.done,
+            "total": self.total,
+            "elapsed": round(elapsed, 1),
+            "rate": None if rate is None else round(rate),
+            "eta": None if eta is None else round(eta, 1),
+        }
+
+    # `done` is None when the progress is unknown, e.g. during the import
+    def update(self, done=None):
+        self.done = done
+        now = time.time()
+        if progress_events is None or now - self.reported_at < PROGRESS_EVENT_INTERVAL:
+            return
+        self.reported_at = now
+        emit_event("progress", self.phase, **self.stats(), **self.fields)
+
+    def record_timing(self, status, **fields):
+        elapsed = time.time() - self.started_at
+        processed = None if self.done is None else self.done - self.initial
+        phase_timings.append(
+            {
+                "phase": self.phase,
+                "status": status,
+                "started_at": round(self.started_at, 3),
+                "elapsed": round(elapsed, 3),
+                "bytes": processed,
+                "rate": round(processed / elapsed)
+                if processed and elapsed > 0
+                else None,
+                **self.fields,
+                **fields,
+            }
+        )
+
+    def finish(self, **fields):
+        if self.done is None:
+            self.done = self.total
+        self.record_timing("finish", **fields)
+        emit_event("finish", self.phase, **self.stats(), **{**self.fields, **fields})
+
+    def fail(self, error):
+        self.record_timing("error", error=str(error))
+        emit_event("error", self.phase, error=str(error), **self.stats(), **self.fields)
+
+
+# Writes the timings of the phases finished so far as a JSON report
+def write_phase_report(path, **fields):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    report = {
+        "host": socket.gethostname(),
+        **fields,
+        "phases": phase_timings,
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
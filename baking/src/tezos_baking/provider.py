@@ -2,14 +2,25 @@
 # SPDX-FileCopyrightText: 2024 Oxhead Alpha
 # SPDX-License-Identifier: LicenseRef-MIT-OA
 
+import os
 import re
+import copy
 import json
+import time
+import heapq
 import urllib.request
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
 
 from abc import abstractmethod
 from dataclasses import dataclass
 
 from tezos_baking.util import *
+from tezos_baking.downloader import probe_download
+
+
+# in seconds, for each of the metadata requests
+metadata_request_timeout = 30
 
 
 def get_node_version():
@@ -34,42 +45,14 @@ class Provider:
         pass
 
 
+# Provider serving the snapshots listing in the tezos-snapshots.json format
 @dataclass
-class Marigold(Provider):
+class XtzShotsLike(Provider):
     metadata_url: str
-    # Returns relevant snapshot's metadata
-    # It filters out provided snapshots by `network` and `history_mode`
-    # provided by the user and then follows this steps:
-    # * tries to find the snapshot of exact same Octez version, that is used by the user.
-    # * if there is none, try to find the snapshot with the same major version, but less minor version
-    #   and with the `snapshot_version` compatible with the user's Octez version.
-    # * If there is none, try to find the snapshot with any Octez version, but compatible `snapshot_version`.
-    def extract_relevant_snapshot(self, snapshot_array, network, history_mode):
-        from functools import reduce
-
-        def find_snapshot(pred):
-            return next(
-                filter(
-                    lambda artifact: artifact["artifact_type"] == "tezos-snapshot"
-                    and artifact["chain_name"] == network
-                    and (
-                        artifact["history_mode"] == history_mode
-                        or (
-                            history_mode == "archive"
-                            and artifact["history_mode"] == "full"
-                        )
-                    )
-                    and pred(
-                        *(
-                            get_artifact_node_version(artifact)
-                            + (artifact.get("snapshot_version", None),)
-                        )
-                    ),
-                    iter(snapshot_array),
-                ),
-                None,
-            )
-
+    # Groups the snapshots by (chain_name, history_mode) along with their
+    # parsed versions, keeping the order of the listing
+    @staticmethod
+    def index_snapshots(snapshot_array):
         def get_artifact_node_version(artifact):
             version = artifact["tezos_version"]["version"]
             # there seem to be some inconsistency with that field in different providers
@@ -81,116 +64,172 @@ class Marigold(Provider):
                 None if type(additional_info) == str else additional_info["rc"],
             )
 
-        def compose_pred(*preds):
-            return reduce(
-                lambda acc, x: lambda major, minor, rc, snapshot_version: acc(
-                    major, minor, rc, snapshot_version
+        index = {}
+        for position, artifact in enumerate(snapshot_array):
+            if artifact["artifact_type"] != "tezos-snapshot":
+                continue
+            index.setdefault(
+                (artifact["chain_name"], artifact["history_mode"]), []
+            ).append(
+                (
+                    position,
+                    get_artifact_node_version(artifact),
+                    artifact.get("snapshot_version", None),
+                    artifact,
                 )
-                and x(major, minor, rc, snapshot_version),
-                preds,
             )
+        return index
 
-        def sum_pred(*preds):
-            return reduce(
-                lambda acc, x: lambda major, minor, rc, snapshot_version: acc(
-                    major, minor, rc, snapshot_version
-                )
-                or x(major, minor, rc, snapshot_version),
-                preds,
-            )
+    # Returns the index of the listing, the index of the last listing is reused
+    def get_snapshots_index(self, snapshot_array):
+        cached = getattr(self, "snapshots_index", None)
+        if cached is None or cached[0] is not snapshot_array:
+            cached = (snapshot_array, self.index_snapshots(snapshot_array))
+            self.snapshots_index = cached
+        return cached[1]
 
-        node_version = get_node_version()
+    # Returns relevant snapshot's metadata
+    # It filters out provided snapshots by `network` and `history_mode`
+    # provided by the user and then follows this steps:
+    # * tries to find the snapshot of exact same Octez version, that is used by the user.
+    # * if there is none, try to find the snapshot with the same major version, but less minor version
+    #   and with the `snapshot_version` compatible with the user's Octez version.
+    # * If there is none, try to find the snapshot with any Octez version, but compatible `snapshot_version`.
+    # In each case the snapshot with the highest block is chosen, the earlier one
+    # in the listing if there are several.
+    def extract_relevant_snapshot(
+        self, snapshot_array, network, history_mode, node_version=None
+    ):
+        if node_version is None:
+            node_version = get_node_version()
         major_version, minor_version, rc_version = node_version
 
-        exact_version_pred = (
-            lambda major, minor, rc, snapshot_version: node_version
-            == (
-                major,
-                minor,
-                rc,
+        index = self.get_snapshots_index(snapshot_array)
+        candidates = index.get((network, history_mode), [])
+        if history_mode == "archive":
+            candidates = heapq.merge(candidates, index.get((network, "full"), []))
+
+        def version_tier(version, snapshot_version):
+            if version == node_version:
+                return 0
+            major, minor, rc = version
+            non_rc_on_stable = (rc_version is None and rc is None) or (
+                rc_version is not None
             )
-        )
+            # it could happen that `snapshot_version` field is not supplied by provider
+            # e.g. marigold snapshots don't supply it
+            compatible_version = (
+                snapshot_version and compatible_snapshot_version - snapshot_version <= 2
+            )
+            if not (non_rc_on_stable and compatible_version):
+                return None
+            less_rc_version = rc and rc_version and rc_version > rc
+            if major_version == major and (
+                (minor_version == minor and less_rc_version)
+                or (minor_version > minor and rc is None)
+            ):
+                return 1
+            return 2
+
+        # the best snapshot found so far for each tier
+        best = [None, None, None]
+        for _, version, snapshot_version, artifact in candidates:
+            tier = version_tier(version, snapshot_version)
+            if tier is None:
+                continue
+            if (
+                best[tier] is None
+                or artifact["block_height"] > best[tier]["block_height"]
+            ):
+                best[tier] = artifact
+
+        return next((snapshot for snapshot in best if snapshot is not None), None)
 
-        exact_major_version_pred = (
-            lambda major, minor, rc, snapshot_version: major_version == major
-        )
+    def get_snapshot_metadata(self, network, history_mode, region=None):
+        snapshot_array = get_json_cached(
+            self.metadata_url, timeout=metadata_request_timeout
+        )["data"]
+        snapshot = self.extract_relevant_snapshot(snapshot_array, network, history_mode)
+        if snapshot is None:
+            return None
+        # the artifact belongs to the cached listing
+        snapshot = copy.deepcopy(snapshot)
+        # the urls in the listing may be relative to it, e.g. the ones of
+        # the snapshots exported by tezos-node-snapshot-export
+        if snapshot.get("url", None) is not None:
+            snapshot["url"] = urljoin(self.metadata_url, snapshot["url"])
+        return snapshot
 
-        exact_minor_version_pred = (
-            lambda major, minor, rc, snapshot_version: minor_version == minor
-        )
 
-        less_minor_version_pred = (
-            lambda major, minor, rc, snapshot_version: minor_version > minor
-        )
+class Marigold(XtzShotsLike):
+    pass
 
-        exact_rc_version_pred = (
-            lambda major, minor, rc, snapshot_version: rc_version == rc
-        )
 
-        less_rc_version_pred = (
-            lambda major, minor, rc, snapshot_version: rc
-            and rc_version
-            and rc_version > rc
+@dataclass
+class TzInit(Provider):
+    # the snapshots of each region are served at this url with the region
+    # substituted for '{region}'
+    base_url: str = "https://snapshots.{region}.tzinit.org"
+
+    regions = ["eu", "us", "asia"]
+    # the fastest region is probed again after a day
+    region_cache_ttl = 24 * 60 * 60
+    region_cache_file = "tzinit-region.json"
+    probe_sample_size = 4 * 1024 * 1024
+    probe_timeout = 10
+
+    def get_base_url(self, region):
+        return self.base_url.format(region=region)
+
+    # Returns the metadata latency and the download throughput of the region
+    # measured on the first bytes of the snapshot
+    def probe_region(self, region, network, history_mode):
+        base_url = self.get_base_url(region)
+        start = time.monotonic()
+        request = urllib.request.Request(
+            f"{base_url}/{network}/{history_mode}.json", headers=http_request_headers
         )
-
-        non_rc_version_pred = lambda major, minor, rc, snapshot_version: rc is None
-
-        compatible_version_pred = (
-            # it could happen that `snapshot_version` field is not supplied by provider
-            # e.g. marigold snapshots don't supply it
-            lambda major, minor, rc, snapshot_version: snapshot_version
-            and compatible_snapshot_version - snapshot_version <= 2
+        with urllib.request.urlopen(request, timeout=self.probe_timeout) as response:
+            response.read()
+        latency = time.monotonic() - start
+
+        throughput, _ = probe_download(
+            f"{base_url}/{network}/{history_mode}",
+            self.probe_sample_size,
+            self.probe_timeout,
         )
+        return (latency, throughput)
 
-        non_rc_on_stable_pred = lambda major, minor, rc, snapshot_version: (
-            rc_version is None and rc is None
-        ) or (rc_version is not None)
-
-        preds = [
-            exact_version_pred,
-            compose_pred(
-                non_rc_on_stable_pred,
-                compatible_version_pred,
-                sum_pred(
-                    compose_pred(
-                        exact_major_version_pred,
-                        exact_minor_version_pred,
-                        less_rc_version_pred,
-                    ),
-                    compose_pred(
-                        exact_major_version_pred,
-                        less_minor_version_pred,
-                        non_rc_version_pred,
-                    ),
-                ),
-            ),
-            compose_pred(
-                non_rc_on_stable_pred,
-                compatible_version_pred,
-            ),
-        ]
+    # Probes all the regions at the same time, returns None if none of them
+    # is reachable
+    def find_fastest_region(self, network, history_mode):
+        cached = read_cached_json(self.region_cache_file, self.region_cache_ttl)
+        if cached is not None and cached.get("region") in self.regions:
+            return cached["region"]
 
-        return next(
-            (
-                snapshot
-                for snapshot in map(
-                    lambda pred: find_snapshot(pred),
-                    preds,
-                )
-                if snapshot is not None
-            ),
-            None,
-        )
-
-    def get_snapshot_metadata(self, network, history_mode, region=None):
-        snapshot_array = None
-        with urllib.request.urlopen(self.metadata_url) as url:
-            snapshot_array = json.load(url)["data"]
-        snapshot_array.sort(reverse=True, key=lambda x: x["block_height"])
-        return self.extract_relevant_snapshot(snapshot_array, network, history_mode)
+        history_mode = "full" if history_mode == "archive" else history_mode
 
+        def probe(region):
+            try:
+                return self.probe_region(region, network, history_mode)
+            except (urllib.error.URLError, OSError, ValueError):
+                return None
+
+        with ThreadPoolExecutor(max_workers=len(self.regions)) as executor:
+            results = dict(zip(self.regions, executor.map(probe, self.regions)))
+
+        reachable = {
+            region: result for region, result in results.items() if result is not None
+        }
+        if not reachable:
+            return None
+        # the snapshot download time is dominated by the throughput
+        fastest = max(
+            reachable, key=lambda region: (reachable[region][1], -reachable[region][0])
+        )
+        write_cached_json(self.region_cache_file, {"region": fastest})
+        return fastest
 
-class TzInit(Provider):
     def get_filesize(self, url):
         request = urllib.request.Request(
             url, headers=http_request_headers, method="HEAD"
@@ -198,33 +237,32 @@ class TzInit(Provider):
         content_length = next(
             (
                 header[1]
-                for header in urllib.request.urlopen(request).info()._headers
+                for header in urllib.request.urlopen(
+                    request, timeout=metadata_request_timeout
+                )
+                .info()
+                ._headers
                 if header[0] == "Content-Length"
             ),
             None,
         )
         if content_length is not None:
-            suffixes = ["B", "KB", "MB", "GB", "TB", "PB"]
-            nbytes = int(content_length)
-            i = 0
-            while nbytes >= 1024 and i < len(suffixes) - 1:
-                nbytes /= 1024.0
-                i += 1
-            f = ("%.2f" % nbytes).rstrip("0").rstrip(".")
-            return "%s%s" % (f, suffixes[i])
+            return format_size(int(content_length))
         return content_length
 
     def get_snapshot_metadata(self, network, history_mode, region=None):
         region = "eu" if region is None else region
         history_mode = "full" if history_mode == "archive" else history_mode
-        self.metadata_url = f"https://snapshots.{region}.tzinit.org/{network}/{history_mode}.json"
-        with urllib.request.urlopen(self.metadata_url) as url:
-            snapshot_metadata = json.load(url)["snapshot_header"]
+        base_url = self.get_base_url(region)
+        self.metadata_url = f"{base_url}/{network}/{history_mode}.json"
+        snapshot_metadata = copy.deepcopy(
+            get_json_cached(self.metadata_url, timeout=metadata_request_timeout)[
+                "snapshot_header"
+            ]
+        )
 
         snapshot_metadata["block_height"] = snapshot_metadata["level"]
-        snapshot_metadata[
-            "url"
-        ] = f"https://snapshots.{region}.tzinit.org/{network}/{history_mode}"
+        snapshot_metadata["url"] = f"{base_url}/{network}/{history_mode}"
         snapshot_metadata["sha256"] = None
         snapshot_metadata["filesize"] = (
             "not provided"
@@ -238,10 +276,18 @@ class TzInit(Provider):
 
 compatible_snapshot_version = 7
 
+# The providers' urls can be overridden, e.g. to use a local stand-in
 default_providers = [
-    TzInit("tzinit"),
+    TzInit(
+        "tzinit",
+        os.getenv("TEZOS_TZINIT_URL", "https://snapshots.{region}.tzinit.org"),
+    ),
     Marigold(
-        "marigold.dev", "https://snapshots.tezos.marigold.dev/api/tezos-snapshots.json"
+        "marigold.dev",
+        os.getenv(
+            "TEZOS_MARIGOLD_URL",
+            "https://snapshots.tezos.marigold.dev/api/tezos-snapshots.json",
+        ),
     ),
 ]
 
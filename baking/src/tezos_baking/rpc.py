@@ -0,0 +1,101 @@
+# SPDX-FileCopyrightText: 2025 Oxhead Alpha
+# SPDX-License-Identifier: LicenseRef-MIT-OA
+
+"""
+Contains the client of the node RPC, used by the wizards for the read-only
+calls instead of spawning curl or octez-client for each of them
+"""
+
+import re
+import json
+import logging
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+from tezos_baking.util import *
+
+# in seconds
+rpc_timeout = 10
+# Block hashes are 51 base58 characters starting with 'B'
+block_hash_regex = r"B[1-9A-HJ-NP-Za-km-z]{50}"
+
+
+class RPCError(Exception):
+    "Raised when the node RPC can't be called or responds with an error."
+
+
+class RPCClient:
+    def __init__(self, endpoint, timeout=rpc_timeout):
+        self.endpoint = endpoint
+        url = urlsplit(endpoint if "://" in endpoint else "http://" + endpoint)
+        self.https = url.scheme == "https"
+        self.netloc = url.netloc
+        self.base_path = url.path.rstrip("/")
+        self.timeout = timeout
+        # the connection is kept alive between the calls
+        self.connection = None
+        self.lock = threading.Lock()
+        # responses of the blocks given by hash by path, they never change
+        self.block_cache = {}
+
+    def connect(self):
+        if self.https:
+            return http.client.HTTPSConnection(self.netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(self.netloc, timeout=self.timeout)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def request(self, path):
+        headers = {**http_request_headers, "Accept": "application/json"}
+        # the node can close the idle connection, then the call is made again
+        # on a new one, which is safe since the calls only read
+        for attempt in range(2):
+            reused = self.connection is not None
+            if not reused:
+                self.connection = self.connect()
+            try:
+                self.connection.request("GET", self.base_path + path, headers=headers)
+                response = self.connection.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                self.close()
+                if reused and attempt == 0:
+                    continue
+                raise RPCError(f"Couldn't call {self.endpoint}{path}: {e}")
+            if response.will_close:
+                self.close()
+            return (response.status, body)
+
+    # Returns the decoded JSON response of the RPC at `path`, e.g. '/version'
+    def get(self, path):
+        logging.info(f"Calling the node RPC {path}")
+        with self.lock:
+            status, body = self.request(path)
+        if status != 200:
+            raise RPCError(
+                f"{self.endpoint}{path} responded with {status}: "
+                + body.decode("utf-8", errors="replace").strip()
+            )
+        try:
+            return json.loads(body)
+        except ValueError as e:
+            raise RPCError(f"Invalid JSON from {self.endpoint}{path}: {e}")
+
+    # Calls the RPC of the block, e.g. 'context/constants'. The responses
+    # of the blocks given by hash are cached, 'head' and the levels aren't.
+    def get_block(self, path, block="head", chain="main"):
+        full_path = f"/chains/{chain}/blocks/{block}/{path.lstrip('/')}"
+        if not re.fullmatch(block_hash_regex, block):
+            return self.get(full_path)
+        if full_path not in self.block_cache:
+            self.block_cache[full_path] = self.get(full_path)
+        return self.block_cache[full_path]
+
+    # Returns the hash of the current head, so that the calls for it are
+    # cached and all of them read the same block
+    def head_hash(self, chain="main"):
+        return self.get(f"/chains/{chain}/blocks/head/hash")
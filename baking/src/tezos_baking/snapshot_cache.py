@@ -0,0 +1,215 @@
+# SPDX-FileCopyrightText: 2025 Oxhead Alpha
+# SPDX-License-Identifier: LicenseRef-MIT-OA
+
+"""
+Contains persistent on-host cache of the downloaded node snapshots
+"""
+
+import os
+import json
+import time
+import shutil
+import fcntl
+import logging
+import contextlib
+
+from tezos_baking.downloader import MANIFEST_SUFFIX
+
+DEFAULT_CACHE_DIR = "/var/tmp/tezos-snapshots"
+# in GiB
+DEFAULT_CACHE_SIZE = 100
+
+INDEX_FILE = "index.json"
+LOCK_FILE = ".lock"
+# Directory for the downloads that are not finished yet
+PARTIAL_DIR = "partial"
+# Suffix of the snapshot decompressed next to the downloaded one
+DECOMPRESSED_SUFFIX = ".decompressed"
+# Files kept next to the partially downloaded snapshot: the block checksums
+# manifest and the expected sha256
+PARTIAL_SUFFIXES = [MANIFEST_SUFFIX, ".sha256"]
+
+
+def normalize_history_mode(history_mode):
+    # archive nodes are bootstrapped from the full snapshots
+    return "full" if history_mode == "archive" else history_mode
+
+
+class SnapshotCache:
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_size=DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        # in bytes
+        self.max_size = int(max_size * 1024**3)
+        self.index_file = os.path.join(directory, INDEX_FILE)
+        self.partial_dir = os.path.join(directory, PARTIAL_DIR)
+        os.makedirs(self.partial_dir, exist_ok=True)
+        # the snapshots are imported by the 'tezos' user
+        if os.stat(self.directory).st_uid == os.getuid():
+            os.chmod(self.directory, 0o755)
+
+    # Serializes index updates between wizards running at the same time
+    @contextlib.contextmanager
+    def locked_index(self):
+        with open(os.path.join(self.directory, LOCK_FILE), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                index = self.read_index()
+                yield index
+                self.write_index(index)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def read_index(self):
+        try:
+            with open(self.index_file, "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        # drop entries which files were removed manually
+        return {
+            key: entry
+            for key, entry in index.items()
+            if os.path.isfile(os.path.join(self.directory, entry["file"]))
+        }
+
+    def write_index(self, index):
+        with open(self.index_file + ".tmp", "w") as f:
+            json.dump(index, f, indent=2)
+        os.replace(self.index_file + ".tmp", self.index_file)
+
+    @staticmethod
+    def make_key(provider, network, history_mode, block_hash, sha256):
+        return "|".join(
+            [
+                provider,
+                network,
+                normalize_history_mode(history_mode),
+                str(block_hash),
+                str(sha256),
+            ]
+        )
+
+    @staticmethod
+    def matches(entry, network, history_mode, block_hash, sha256):
+        if entry["network"] != network:
+            return False
+        if entry["history_mode"] != normalize_history_mode(history_mode):
+            return False
+        # the same snapshot could have been downloaded from another provider
+        if block_hash is not None and entry["block_hash"] != block_hash:
+            return False
+        if sha256 is not None and entry["sha256"] not in [None, sha256]:
+            return False
+        return block_hash is not None or (
+            sha256 is not None and entry["sha256"] == sha256
+        )
+
+    # Returns the entry of the cached snapshot matching the given block hash
+    # or sha256, if any. Marks the entry as recently used.
+    def lookup(self, network, history_mode, block_hash=None, sha256=None):
+        if block_hash is None and sha256 is None:
+            return None
+        with self.locked_index() as index:
+            for entry in index.values():
+                if self.matches(entry, network, history_mode, block_hash, sha256):
+                    entry["last_used"] = time.time()
+                    logging.info(f"Found cached snapshot {entry['file']}")
+                    return {
+                        **entry,
+                        "path": os.path.join(self.directory, entry["file"]),
+                    }
+        return None
+
+    def entries(self):
+        with self.locked_index() as index:
+            return [
+                {**entry, "path": os.path.join(self.directory, entry["file"])}
+                for entry in index.values()
+            ]
+
+    # Marks the cached snapshot as recently used
+    def touch(self, filename):
+        with self.locked_index() as index:
+            for entry in index.values():
+                if entry["file"] == filename:
+                    entry["last_used"] = time.time()
+
+    def size(self, index):
+        return sum(entry["size"] for entry in index.values())
+
+    # Removes the least recently used snapshots until `reserve` more bytes fit
+    def evict(self, index, reserve=0):
+        for key, entry in sorted(index.items(), key=lambda kv: kv[1]["last_used"]):
+            if self.size(index) + reserve <= self.max_size:
+                break
+            logging.info(f"Evicting cached snapshot {entry['file']}")
+            try:
+                os.remove(os.path.join(self.directory, entry["file"]))
+            except FileNotFoundError:
+                pass
+            del index[key]
+
+    # Moves the downloaded snapshot to the cache, returns its new path.
+    # Snapshots bigger than the cache are left where they are.
+    def store(
+        self,
+        snapshot_file,
+        provider,
+        network,
+        history_mode,
+        block_hash=None,
+        sha256=None,
+        metadata=None,
+        file_sha256=None,
+    ):
+        size = os.path.getsize(snapshot_file)
+        if size > self.max_size:
+            logging.info("The snapshot doesn't fit into the cache")
+            return snapshot_file
+        key = self.make_key(provider, network, history_mode, block_hash, sha256)
+        filename = f"{network}-{normalize_history_mode(history_mode)}-"
+        filename += f"{block_hash or sha256 or int(time.time())}.snapshot"
+        with self.locked_index() as index:
+            index.pop(key, None)
+            # the same snapshot may be already cached under another provider
+            for other in [k for k, e in index.items() if e["file"] == filename]:
+                del index[other]
+            self.evict(index, reserve=size)
+            path = os.path.join(self.directory, filename)
+            shutil.move(snapshot_file, path)
+            index[key] = {
+                "file": filename,
+                "size": size,
+                "last_used": time.time(),
+                "provider": provider,
+                "network": network,
+                "history_mode": normalize_history_mode(history_mode),
+                "block_hash": block_hash,
+                "sha256": sha256,
+                # `sha256` is of the downloaded file, which could be compressed
+                "file_sha256": file_sha256,
+                "metadata": metadata,
+            }
+        logging.info(f"Stored snapshot in the cache as {filename}")
+        return path
+
+    # Removes the leftovers of the download of the imported snapshot, e.g.
+    # the snapshot that didn't fit into the cache. The other files are kept,
+    # since they can be the downloads of other wizards running at the same
+    # time or the interrupted downloads to be resumed.
+    def clean_partial(self, snapshot_file):
+        if os.path.dirname(os.path.abspath(snapshot_file)) != os.path.abspath(
+            self.partial_dir
+        ):
+            return
+        downloaded_file = snapshot_file
+        if downloaded_file.endswith(DECOMPRESSED_SUFFIX):
+            downloaded_file = downloaded_file[: -len(DECOMPRESSED_SUFFIX)]
+        for path in [snapshot_file, downloaded_file] + [
+            downloaded_file + suffix for suffix in PARTIAL_SUFFIXES
+        ]:
+            try:
+                os.remove(path)
+                logging.info(f"Removed {path}")
+            except FileNotFoundError:
+                pass
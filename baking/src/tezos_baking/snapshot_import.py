@@ -0,0 +1,127 @@
+# SPDX-FileCopyrightText: 2025 Oxhead Alpha
+# SPDX-License-Identifier: LicenseRef-MIT-OA
+
+"""
+Contains the snapshot decompression and import steps shared by tezos-setup
+and tezos-bootstrap
+"""
+
+import os
+import logging
+
+from tezos_baking.util import *
+from tezos_baking.wizard_structure import print_and_log
+from tezos_baking.downloader import *
+from tezos_baking.compression import *
+from tezos_baking.snapshot_cache import DECOMPRESSED_SUFFIX
+
+# Content expected in a configured and clean node data dir
+node_dir_config = set(["config.json", "version.json"])
+
+# ionice options for each of the I/O priorities
+io_priorities = {
+    "normal": None,
+    "low": "-c 2 -n 7",
+    "idle": "-c 3",
+}
+
+
+class NotEnoughSpace(Exception):
+    "Raised when there is no space for the snapshot on the filesystem."
+
+    def __init__(self, dirname, required, available):
+        self.dirname = dirname
+        self.required = required
+        self.available = available
+
+    def __str__(self):
+        return (
+            f"There is not enough space for the snapshot in {self.dirname}: "
+            f"{format_size(self.required)} is required, "
+            f"but only {format_size(self.available)} is available."
+        )
+
+
+def check_free_space(dirname, required):
+    stat = os.statvfs(dirname)
+    available = stat.f_bavail * stat.f_frsize
+    if available < required:
+        raise NotEnoughSpace(dirname, required, available)
+
+
+# Creates the directory owned by the current user, with sudo if needed
+def make_user_dir(path):
+    if os.path.isdir(path) and os.access(path, os.W_OK):
+        return
+    try:
+        os.makedirs(path)
+    except (PermissionError, FileExistsError):
+        proc_call(f"sudo install -d -o {os.getuid()} -g {os.getgid()} -m 0755 {path}")
+
+
+# Returns the space needed for the snapshot at `url` of `size` bytes,
+# the compressed snapshot is decompressed next to it
+def get_required_space(url, size):
+    if detect_remote_compression(url) is not None:
+        return size + estimate_decompressed_size(size)
+    return size
+
+
+# Decompresses the zstd or xz compressed snapshot next to it,
+# returns the path of the snapshot to import
+def decompress_snapshot(filename, keep_input=False, report=print_and_log):
+    compression = detect_file_compression(filename)
+    if compression is None:
+        return filename
+    check_free_space(
+        os.path.dirname(os.path.abspath(filename)),
+        get_decompressed_size(filename, compression),
+    )
+    report(f"Decompressing the {compression.name} compressed snapshot...")
+    output_filename = filename + DECOMPRESSED_SUFFIX
+    try:
+        compressed_sha256, decompressed_sha256 = decompress_file(
+            filename, output_filename, compression
+        )
+    except BaseException:
+        try:
+            os.remove(output_filename)
+        except FileNotFoundError:
+            pass
+        raise
+    if not keep_input:
+        os.remove(filename)
+    record_streamed_sha256(output_filename, decompressed_sha256)
+    # the expected sha256 may be of the compressed file
+    record_streamed_sha256(output_filename, compressed_sha256, compressed_digests)
+    return output_filename
+
+
+def update_history_mode(network, data_dir, history_mode):
+    logging.info("Updating history mode octez-node config")
+    proc_call(
+        f"sudo -u tezos octez-node-{network} config update "
+        f"--data-dir {data_dir} "
+        f"--history-mode {history_mode}"
+    )
+
+
+def snapshot_import_command(
+    network,
+    snapshot_file,
+    block_hash=None,
+    reconstruct=False,
+    data_dir=None,
+    io_priority="normal",
+):
+    ionice_options = io_priorities[io_priority]
+    ionice = "" if ionice_options is None else f"ionice {ionice_options} "
+
+    return (
+        ionice
+        + f"sudo -u tezos octez-node-{network} snapshot import "
+        + ("--reconstruct " if reconstruct else "")
+        + snapshot_file
+        + ("" if block_hash is None else f" --block {block_hash}")
+        + ("" if data_dir is None else f" --data-dir {data_dir}")
+    )
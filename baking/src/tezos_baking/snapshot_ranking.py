@@ -0,0 +1,95 @@
+# SPDX-FileCopyrightText: 2025 Oxhead Alpha
+# SPDX-License-Identifier: LicenseRef-MIT-OA
+
+"""
+Contains the estimation of the time it takes to get a synced node from
+the snapshot, used to choose among the snapshots of all the providers
+"""
+
+import time
+import calendar
+from dataclasses import dataclass
+
+# in seconds, used when it can't be estimated from the snapshots
+default_block_time = 8
+# Blocks per second validated by the node catching up with the chain,
+# used until it's measured on the host
+default_catchup_rate = 5
+# The block time is estimated only from the snapshots that are
+# at least this many blocks apart
+min_block_time_sample = 100
+
+
+def parse_block_timestamp(timestamp):
+    return calendar.timegm(time.strptime(timestamp, "%Y-%m-%dT%H:%M:%SZ"))
+
+
+# Estimates the block time from the levels and timestamps of the snapshots
+def estimate_block_time(snapshots):
+    blocks = sorted(
+        (snapshot["block_height"], parse_block_timestamp(snapshot["block_timestamp"]))
+        for snapshot in snapshots
+    )
+    if len(blocks) < 2:
+        return default_block_time
+    (first_level, first_time), (last_level, last_time) = blocks[0], blocks[-1]
+    if last_level - first_level < min_block_time_sample or last_time <= first_time:
+        return default_block_time
+    return (last_time - first_time) / (last_level - first_level)
+
+
+@dataclass
+class SyncEstimate:
+    name: str
+    size: int
+    # in bytes per second
+    throughput: float
+    # in seconds
+    download_time: float
+    import_time: float
+    catchup_time: float
+    # the download and the import overlap with the streaming import
+    streaming: bool = False
+
+    def total(self):
+        if self.streaming:
+            return max(self.download_time, self.import_time) + self.catchup_time
+        return self.download_time + self.import_time + self.catchup_time
+
+
+# The node is behind the chain by the age of the snapshot once it's imported,
+# then it catches up validating `catchup_rate` blocks per second, while
+# the new blocks keep coming every `block_time` seconds
+def estimate_time_to_sync(
+    name,
+    metadata,
+    size,
+    throughput,
+    import_rate,
+    catchup_rate=default_catchup_rate,
+    block_time=default_block_time,
+    streaming=False,
+    now=None,
+):
+    now = time.time() if now is None else now
+    estimate = SyncEstimate(
+        name,
+        size,
+        throughput,
+        download_time=size / throughput,
+        import_time=size / import_rate,
+        catchup_time=0,
+        streaming=streaming,
+    )
+    node_started_at = now + estimate.total()
+    behind = (
+        node_started_at - parse_block_timestamp(metadata["block_timestamp"])
+    ) / block_time
+    net_rate = catchup_rate - 1 / block_time
+    estimate.catchup_time = max(behind, 0) / net_rate if net_rate > 0 else float("inf")
+    return estimate
+
+
+# Returns the estimates from the soonest synced node to the latest one
+def rank_snapshots(estimates):
+    return sorted(estimates, key=lambda estimate: estimate.total())
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2025 Oxhead Alpha
+# SPDX-License-Identifier: LicenseRef-MIT-OA
+
+"""
+Bootstraps the nodes of several networks on this host from the snapshots at once.
+
+The snapshots are downloaded concurrently within the shared bandwidth limit,
+while the disk-heavy decompression and import run only for a limited number
+of networks at a time, so that one network is downloaded while another one
+is imported.
+"""
+
+import os, sys
+import time
+import argparse
+import logging
+import threading
+import subprocess
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from tezos_baking.util import *
+from tezos_baking.wizard_structure import get_data_dir, print_and_log, setup_logger
+from tezos_baking.provider import *
+from tezos_baking.downloader import *
+from tezos_baking.compression import *
+from tezos_baking.snapshot_cache import DECOMPRESSED_SUFFIX
+from tezos_baking.snapshot_import import *
+import tezos_baking.downloader as downloader
+
+history_modes = ["rolling", "full", "archive"]
+# Directory next to the node data directories where the snapshots are downloaded
+STAGING_DIR_NAME = "tezos-bootstrap.d"
+
+
+class BootstrapError(Exception):
+    "Raised when the network can't be bootstrapped from the snapshot."
+
+
+@dataclass
+class NetworkBootstrap:
+    network: str
+    history_mode: str
+    # the snapshot is looked up in the default providers if it's not given
+    snapshot_url: str = None
+    node_dir: str = None
+    status: str = "pending"
+    error: str = None
+    started_at: float = None
+    finished_at: float = None
+    # known from the provider's metadata
+    sha256: str = None
+    block_hash: str = None
+    snapshot_history_mode: str = None
+    snapshot_size: int = None
+
+
+# Parses '<network>[:<history mode>]', e.g. 'mainnet' or 'custom@dev:full'
+def parse_network_spec(spec, default_history_mode):
+    network, _, history_mode = spec.partition(":")
+    history_mode = history_mode or default_history_mode
+    if not network or history_mode not in history_modes:
+        raise argparse.ArgumentTypeError(f"Invalid network: {spec}")
+    return NetworkBootstrap(network, history_mode)
+
+
+def find_snapshot(network, history_mode):
+    for provider in default_providers:
+        try:
+            metadata = provider.get_snapshot_metadata(network, history_mode)
+        except Exception as e:
+            logging.warning(
+                f"Couldn't get the {network} snapshot from {provider.title}: {e}"
+            )
+            continue
+        if metadata is not None:
+            return (provider.title, metadata)
+    return None
+
+
+def get_staging_dir(node_dir):
+    return os.path.join(os.path.dirname(node_dir), STAGING_DIR_NAME)
+
+
+class BootstrapScheduler:
+    def __init__(self, jobs, max_imports=1, keep_snapshots=False):
+        self.jobs = jobs
+        # limits the concurrent decompressions and imports
+        self.import_slots = threading.Semaphore(max_imports)
+        self.keep_snapshots = keep_snapshots
+        self.output_lock = threading.Lock()
+
+    def log(self, job, message, log=logging.info, colorcode=None):
+        with self.output_lock:
+            print_and_log(f"{job.network}: {message}", log=log, colorcode=colorcode)
+
+    def set_status(self, job, status):
+        job.status = status
+        self.log(job, status)
+
+    def fail(self, job, error):
+        job.status = "failed"
+        job.error = str(error)
+        job.finished_at = time.time()
+        self.log(job, f"Failed: {error}", log=logging.error, colorcode=color_red)
+
+    # Returns the node data directory, or None if it already has the chain data
+    def prepare_node_dir(self, job):
+        node_dir = job.node_dir
+        try:
+            node_dir_contents = set(os.listdir(node_dir))
+        except FileNotFoundError:
+            raise BootstrapError(f"The node data directory {node_dir} doesn't exist")
+        if "config.json" not in node_dir_contents:
+            raise BootstrapError(f"The node data directory {node_dir} isn't configured")
+        if node_dir_contents - node_dir_config:
+            return None
+        return node_dir
+
+    # Looks up the snapshot of the network and its size
+    def prepare(self, job):
+        job.started_at = time.time()
+        if self.prepare_node_dir(job) is None:
+            self.set_status(job, "skipped, the node already has the chain data")
+            return
+        if job.snapshot_url is None:
+            snapshot = find_snapshot(job.network, job.history_mode)
+            if snapshot is None:
+                raise BootstrapError(
+                    "Couldn't find the snapshot in any of the providers"
+                )
+            provider, metadata = snapshot
+            self.log(
+                job,
+                f"Using the snapshot at level {metadata['block_height']} from {provider}",
+            )
+            job.snapshot_url = metadata["url"]
+            job.sha256 = metadata.get("sha256", None)
+            job.block_hash = metadata.get("block_hash", None)
+            job.snapshot_history_mode = metadata.get(
+                "history_mode", metadata.get("mode", None)
+            )
+        try:
+            job.snapshot_size = get_remote_file(job.snapshot_url).size
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            logging.warning(f"Couldn't get the snapshot file info: {e}")
+
+    # The snapshots are downloaded at once, so the space for all of them and
+    # their decompressed copies is checked on every filesystem beforehand
+    def reserve_space(self, jobs):
+        filesystems = {}
+        for job in jobs:
+            staging_dir = get_staging_dir(job.node_dir)
+            try:
+                make_user_dir(staging_dir)
+                device = os.stat(staging_dir).st_dev
+            except (OSError, subprocess.CalledProcessError) as e:
+                self.fail(job, e)
+                continue
+            filesystems.setdefault(device, (staging_dir, []))[1].append(job)
+        for staging_dir, fs_jobs in filesystems.values():
+            required = sum(
+                get_required_space(job.snapshot_url, job.snapshot_size)
+                for job in fs_jobs
+                if job.snapshot_size
+            )
+            try:
+                check_free_space(staging_dir, required)
+            except NotEnoughSpace as e:
+                for job in fs_jobs:
+                    self.fail(job, e)
+
+    def download(self, job, staging_dir):
+        url = job.snapshot_url
+        filename = os.path.join(staging_dir, f"{job.network}.snapshot")
+        self.set_status(job, "downloading")
+        started_at = time.time()
+        try:
+            actual_sha256 = download_in_segments(
+                url, filename, resume=True, sha256=job.sha256
+            )
+        except RangesNotSupported:
+            with open(filename, "wb") as f:
+                actual_sha256 = download_sequentially(url, f)
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise BootstrapError(f"Couldn't download the snapshot from {url}: {e}")
+        if job.sha256 and actual_sha256 and actual_sha256 != job.sha256:
+            os.remove(filename)
+            raise BootstrapError("SHA256 mismatch")
+        self.log(
+            job,
+            f"Downloaded {format_size(os.path.getsize(filename))} "
+            f"in {format_duration(time.time() - started_at)}",
+        )
+        return filename
+
+    def import_snapshot(self, job, node_dir, filename):
+        filename = decompress_snapshot(
+            filename, report=lambda message: self.log(job, message)
+        )
+
+        self.set_status(job, "importing")
+        started_at = time.time()
+        update_history_mode(job.network, node_dir, job.history_mode)
+        reconstruct = (
+            job.history_mode == "archive" and job.snapshot_history_mode != "archive"
+        )
+        try:
+            proc_call(
+                snapshot_import_command(
+                    job.network, filename, job.block_hash, reconstruct, node_dir
+                )
+            )
+        except BaseException:
+            # the node is started from scratch rather than on the partial data
+            for path in set(os.listdir(node_dir)) - node_dir_config:
+                proc_call(f"sudo rm -r {os.path.join(node_dir, path)}")
+            raise
+        self.log(job, f"Imported in {format_duration(time.time() - started_at)}")
+
+    def bootstrap(self, job):
+        node_dir = job.node_dir
+        staging_dir = get_staging_dir(node_dir)
+        proc_call(f"sudo systemctl stop tezos-node-{job.network}.service")
+        # the node is started again even if the bootstrap fails
+        try:
+            filename = self.download(job, staging_dir)
+            try:
+                if not self.import_slots.acquire(blocking=False):
+                    self.set_status(job, "waiting for the other imports to finish")
+                    self.import_slots.acquire()
+                try:
+                    self.import_snapshot(job, node_dir, filename)
+                finally:
+                    self.import_slots.release()
+            finally:
+                if not self.keep_snapshots:
+                    for path in [filename, filename + DECOMPRESSED_SUFFIX]:
+                        if os.path.exists(path):
+                            os.remove(path)
+        finally:
+            proc_call(f"sudo systemctl start tezos-node-{job.network}.service")
+        self.set_status(job, "started")
+
+    def run_job(self, job, step):
+        try:
+            step(job)
+        except (
+            BootstrapError,
+            NotEnoughSpace,
+            OSError,
+            ValueError,
+            urllib.error.URLError,
+            subprocess.CalledProcessError,
+        ) as e:
+            self.fail(job, e)
+        finally:
+            job.finished_at = time.time()
+
+    def run_pending_jobs(self, step):
+        jobs = [job for job in self.jobs if job.status == "pending"]
+        if jobs:
+            with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+                list(executor.map(lambda job: self.run_job(job, step), jobs))
+
+    def run(self):
+        for job in self.jobs:
+            job.node_dir = get_data_dir(job.network)
+        self.run_pending_jobs(self.prepare)
+        self.reserve_space([job for job in self.jobs if job.status == "pending"])
+        self.run_pending_jobs(self.bootstrap)
+        return all(job.status != "failed" for job in self.jobs)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Bootstrap the nodes of several networks from the snapshots at once."
+    )
+    parser.add_argument(
+        "networks",
+        nargs="+",
+        metavar="NETWORK[:HISTORY_MODE]",
+        help="Networks of the tezos-node services to bootstrap, e.g. 'mainnet', "
+        "'ghostnet:full' or 'custom@dev'. The nodes with the chain data are skipped.",
+    )
+    parser.add_argument(
+        "--history-mode",
+        default="rolling",
+        choices=history_modes,
+        help="History mode of the networks without one. Is 'rolling' by default.",
+    )
+    parser.add_argument(
+        "--snapshot-url",
+        action="append",
+        default=[],
+        metavar="NETWORK=URL",
+        help="Snapshot to use for the network instead of the one from the providers, "
+        "e.g. for the custom networks.",
+    )
+    parser.add_argument(
+        "--max-imports",
+        type=int,
+        default=1,
+        help="Number of the snapshots decompressed or imported at once. Is 1 by default.",
+    )
+    parser.add_argument(
+        "--download-rate-limit",
+        type=parse_rate_limit,
+        default=None,
+        help="Total download bandwidth of all the networks, e.g. '50M' bytes "
+        "per second or 'adaptive'. Is unlimited by default.",
+    )
+    parser.add_argument(
+        "--keep-snapshots",
+        action="store_true",
+        help="Keep the downloaded snapshots after the import.",
+    )
+    args = parser.parse_args()
+
+    setup_logger("tezos-bootstrap.log")
+
+    try:
+        jobs = [parse_network_spec(spec, args.history_mode) for spec in args.networks]
+        for snapshot_url in args.snapshot_url:
+            network, _, url = snapshot_url.partition("=")
+            job = next((job for job in jobs if job.network == network), None)
+            if job is None or not url:
+                raise argparse.ArgumentTypeError(
+                    f"Invalid snapshot url: {snapshot_url}"
+                )
+            job.snapshot_url = url
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    if len(set(job.network for job in jobs)) != len(jobs):
+        parser.error("Every network can be given only once")
+    if args.max_imports < 1:
+        parser.error("--max-imports should be at least 1")
+
+    set_download_rate_limit(args.download_rate_limit)
+    # the progress of the concurrent downloads is reported by the scheduler
+    downloader.show_download_progress = False
+
+    scheduler = BootstrapScheduler(jobs, args.max_imports, args.keep_snapshots)
+    succeeded = scheduler.run()
+
+    print()
+    for job in jobs:
+        elapsed = format_duration(job.finished_at - job.started_at)
+        print(f"{job.network}: {job.status} in {elapsed}")
+    sys.exit(0 if succeeded else 1)
+
+
+if __name__ == "__main__":
+    main()
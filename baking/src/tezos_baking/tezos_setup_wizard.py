@@ -9,11 +9,18 @@ Asks questions, validates answers, and executes the appropriate steps using the
 """
 
 import os, sys, shutil
+import errno
+import shlex
+import socket
+import argparse
+import subprocess
 import readline
 import re
 import time
 import urllib.request
 import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 import logging
 
@@ -21,6 +28,12 @@ from tezos_baking.wizard_structure import *
 from tezos_baking.util import *
 from tezos_baking.steps import *
 from tezos_baking.provider import *
+from tezos_baking.downloader import *
+from tezos_baking.snapshot_cache import *
+from tezos_baking.compression import *
+from tezos_baking.snapshot_import import *
+from tezos_baking.progress import *
+from tezos_baking.snapshot_ranking import *
 from tezos_baking.validators import Validator
 import tezos_baking.validators as validators
 
@@ -49,7 +62,115 @@ toggle_vote_modes = {
     "on": "Request to continue or restart the subsidy",
 }
 
+# Used when there is no place for the snapshot next to the node data directory
 TMP_SNAPSHOT_LOCATION = "/tmp/octez_node.snapshot.d/"
+STAGING_DIR_NAME = "octez_node.snapshot.d"
+# Used in the node data directory when it's a mount point
+NODE_DIR_STAGING_NAME = ".octez_node.snapshot.d"
+CACHE_DIR_NAME = "tezos-snapshots"
+
+# Throughputs of the previous downloads and imports on this host
+snapshot_rates_file = "snapshot-rates.json"
+# Headers of the inspected snapshot files
+snapshot_headers_file = "snapshot-headers.json"
+# in bytes per second, used until the import is measured
+default_import_rate = 32 * 1024 * 1024
+# Snapshot mode choosing the snapshot among all the providers
+fastest_to_sync = "fastest to sync"
+# Time to wait for the metadata of the providers other than the chosen one,
+# in seconds, their snapshots are used as download mirrors
+mirror_metadata_timeout = 5
+
+# Command line argument parsing
+
+parser.add_argument(
+    "--snapshot-cache-dir",
+    required=False,
+    default=os.getenv("TEZOS_SNAPSHOT_CACHE_DIR"),
+    help="Directory to keep the downloaded snapshots in, so that they can be reused "
+    "e.g. when bootstrapping the node again or setting up another instance. "
+    f"By default, it's '{CACHE_DIR_NAME}' next to the node data directory, "
+    "and the cache is disabled if the node data directory is a mount point.",
+)
+
+parser.add_argument(
+    "--snapshot-cache-size",
+    required=False,
+    type=float,
+    default=float(os.getenv("TEZOS_SNAPSHOT_CACHE_SIZE", DEFAULT_CACHE_SIZE)),
+    help="Maximal size of the snapshot cache in GiB, the least recently used "
+    "snapshots are removed when it's exceeded. Use 0 to disable the cache.",
+)
+
+
+def rate_limit_arg(value):
+    try:
+        return parse_rate_limit(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+parser.add_argument(
+    "--download-rate-limit",
+    required=False,
+    type=rate_limit_arg,
+    default=os.getenv("TEZOS_SNAPSHOT_RATE_LIMIT", ""),
+    help="Limit of the snapshot download rate in bytes per second, e.g. '20M'. "
+    "With 'adaptive', the limit starts at half of the throughput measured "
+    "in the first seconds of the download, it's halved when the download "
+    "slows down below it, e.g. due to other traffic, and raised back otherwise. "
+    "Not limited by default.",
+)
+
+parser.add_argument(
+    "--io-priority",
+    required=False,
+    choices=io_priorities.keys(),
+    default=os.getenv("TEZOS_SNAPSHOT_IO_PRIORITY", "normal"),
+    help="I/O scheduling priority of the snapshot download and import, "
+    "so that they don't slow down other nodes running on the host. "
+    "Is 'normal' by default.",
+)
+
+parser.add_argument(
+    "--progress-events",
+    required=False,
+    default=os.getenv("TEZOS_PROGRESS_EVENTS"),
+    help="Where to write the snapshot download and import progress as JSON lines: "
+    "a file path, 'unix:<socket path>', 'tcp:<host>:<port>' or 'udp:<host>:<port>'.",
+)
+
+parser.add_argument(
+    "--snapshot-mirror",
+    required=False,
+    action="append",
+    default=os.getenv("TEZOS_SNAPSHOT_MIRRORS", "").split(),
+    help="Url of the additional snapshot provider, e.g. tezos-snapshot-relay. "
+    "When it has the same snapshot as the chosen provider, the snapshot "
+    "is downloaded from both at once. Can be given several times.",
+)
+
+parser.add_argument(
+    "--answers",
+    required=False,
+    default=os.getenv("TEZOS_SETUP_ANSWERS"),
+    help="JSON or YAML file with the answers to the wizard steps keyed by the step ids, "
+    "e.g. 'network: mainnet'. The answered steps aren't asked, so that the setup "
+    "can be scripted. Reading YAML requires PyYAML.",
+)
+
+parsed_args = parser.parse_args()
+
+# argparse doesn't check the defaults taken from the environment against the choices
+if parsed_args.io_priority not in io_priorities:
+    parser.error(
+        f"invalid TEZOS_SNAPSHOT_IO_PRIORITY: '{parsed_args.io_priority}' "
+        f"(choose from {', '.join(io_priorities)})"
+    )
+
+
+def get_mirror_providers():
+    return [XtzShotsLike(f"mirror {url}", url) for url in parsed_args.snapshot_mirror]
 
 
 # Wizard CLI utility
@@ -71,13 +192,109 @@ Type in 'exit' to quit.
 """
 
 
-def fetch_snapshot(url, sha256=None):
+# Returns the space already taken by the partially downloaded file
+def allocated_size(filename):
+    try:
+        return os.stat(filename).st_blocks * 512
+    except FileNotFoundError:
+        return 0
+
+
+def get_snapshot_rates():
+    return read_cached_json(snapshot_rates_file, float("inf")) or {}
+
+
+def record_snapshot_rate(phase, size, elapsed):
+    if size <= 0 or elapsed <= 0:
+        return
+    rates = get_snapshot_rates()
+    rates[phase] = size / elapsed
+    write_cached_json(snapshot_rates_file, rates)
+
+
+# The estimate is based on the rates measured on this host before
+def show_time_estimate(size, downloaded=0):
+    rates = get_snapshot_rates()
+    import_time = size / rates.get("import", default_import_rate)
+    if "download" in rates:
+        download_time = (size - downloaded) / rates["download"]
+        print_and_log(
+            f"Estimated time: {format_duration(download_time)} to download, "
+            f"{format_duration(import_time)} to import, "
+            f"{format_duration(download_time + import_time)} in total."
+        )
+    else:
+        print_and_log(
+            f"Estimated import time: {format_duration(import_time)}, "
+            "the download time is shown once it starts."
+        )
+
+
+# Runs the command like `proc_call` while reporting the progress of
+# the phase, `get_done` returns the amount of processed data if it's known
+def call_with_progress(cmd, progress, get_done=lambda: None):
+    with subprocess.Popen(shlex.split(cmd)) as process:
+        try:
+            while True:
+                try:
+                    returncode = process.wait(timeout=PROGRESS_EVENT_INTERVAL)
+                    break
+                except subprocess.TimeoutExpired:
+                    progress.update(get_done())
+        except BaseException as e:
+            process.kill()
+            progress.fail(e)
+            raise
+    if returncode != 0:
+        error = subprocess.CalledProcessError(returncode, cmd)
+        progress.fail(error)
+        raise error
+    progress.finish()
+
+
+# The archive node storage is reconstructed during the import
+def import_phase(import_cmd):
+    return "reconstruct" if "--reconstruct" in import_cmd else "import"
+
+
+# Returns the files behind the mirror `urls` that are
+# the same size as the `remote` one and allow range requests
+def get_mirror_files(urls, remote):
+    def get_mirror_file(url):
+        try:
+            return get_remote_file(url)
+        except (urllib.error.URLError, ValueError, OSError) as e:
+            logging.warning(f"Couldn't get the snapshot file info from {url}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        mirrors = list(executor.map(get_mirror_file, urls))
+    return [
+        mirror
+        for mirror in mirrors
+        if mirror is not None and mirror.accept_ranges and mirror.size == remote.size
+    ]
+
+
+# The downloads are named after the snapshot, so that the wizards running
+# at the same time don't write to the same file in the shared directory
+def get_snapshot_file_name(network, history_mode, url, sha256=None):
+    key = sha256 or hashlib.sha256(url.encode()).hexdigest()
+    return f"{network}-{history_mode}-{key}.snapshot"
+
+
+def fetch_snapshot(
+    url,
+    sha256=None,
+    dirname=TMP_SNAPSHOT_LOCATION,
+    mirrors=None,
+    name="octez_node.snapshot",
+):
 
     logging.info("Fetching snapshot")
 
-    dirname = TMP_SNAPSHOT_LOCATION
-    filename = os.path.join(dirname, "octez_node.snapshot")
-    metadata_file = os.path.join(dirname, "octez_node.snapshot.sha256")
+    filename = os.path.join(dirname, name)
+    metadata_file = filename + ".sha256"
 
     # updates or removes the 'metadata_file' containing the snapshot's SHA256
     def dump_metadata(metadata_file=metadata_file, sha256=sha256):
@@ -102,8 +319,22 @@ def fetch_snapshot(url, sha256=None):
     def download(filename=filename, url=url, args=""):
         from subprocess import CalledProcessError
 
+        # wget can only apply the fixed limit
+        if isinstance(parsed_args.download_rate_limit, int):
+            args += f" --limit-rate={parsed_args.download_rate_limit}"
+
+        initial = 0
+        if "--continue" in args and os.path.exists(filename):
+            initial = os.path.getsize(filename)
+        progress = PhaseProgress(
+            "download", None if remote is None else remote.size, initial
+        )
         try:
-            proc_call(f"wget {args} --show-progress -O {filename} {url}")
+            call_with_progress(
+                f"wget {args} --show-progress -O {filename} {url}",
+                progress,
+                lambda: os.path.getsize(filename) if os.path.exists(filename) else 0,
+            )
         except CalledProcessError as e:
             # see here https://www.gnu.org/software/wget/manual/html_node/Exit-Status.html
             if e.returncode >= 4:
@@ -115,27 +346,76 @@ def fetch_snapshot(url, sha256=None):
 
     # expected for the (possibly) existing chunk
     expected_sha256 = read_metadata()
+    # that case means that the expected sha256 of snapshot
+    # we want to download is the same as the expected
+    # sha256 of the existing snapshot file
+    # when it will be fully downloaded
+    # so that we can safely resume the download
+    resume = bool(sha256 and expected_sha256 and expected_sha256 == sha256)
 
     os.makedirs(dirname, exist_ok=True)
-    if sha256 and expected_sha256 and expected_sha256 == sha256:
+
+    try:
+        remote = get_remote_file(url)
+    except (urllib.error.URLError, ValueError, OSError) as e:
+        logging.warning(f"Couldn't get the snapshot file info: {e}")
+        remote = None
+
+    downloaded = allocated_size(filename)
+    if remote is not None and remote.size:
+        print_and_log(f"The snapshot size is {format_size(remote.size)}.")
+        check_free_space(dirname, get_required_space(url, remote.size) - downloaded)
+        show_time_estimate(remote.size, downloaded)
+    started_at = time.time()
+
+    def finish():
+        print()
+        if remote is not None and remote.size:
+            record_snapshot_rate(
+                "download", remote.size - downloaded, time.time() - started_at
+            )
+        return decompress_snapshot(filename)
+
+    if remote is not None and remote.accept_ranges and remote.size:
+        # segmented downloads are resumed using the block checksums
+        # manifest, the partial file can't be continued by wget
+        dump_metadata(sha256=None)
+        mirror_files = get_mirror_files(mirrors, remote) if mirrors else []
+        if mirror_files:
+            print_and_log(
+                f"The snapshot is also downloaded from {len(mirror_files)} mirror(s)."
+            )
+        try:
+            download_in_segments(
+                url,
+                filename,
+                resume=True,
+                remote=remote,
+                sha256=sha256,
+                mirrors=mirror_files,
+            )
+            return finish()
+        except RangesNotSupported:
+            print()
+            print_and_log(
+                "The server refused range requests, falling back to wget.",
+                log=logging.warning,
+            )
+            resume = False
+
+    if resume:
         logging.info("Continuing download")
-        # that case means that the expected sha256 of snapshot
-        # we want to download is the same as the expected
-        # sha256 of the existing octez_node.snapshot file
-        # when it will be fully downloaded
-        # so that we can safely use `--continue` option here
         download(args="--continue")
     else:
         # all other cases we just dump new metadata
         # (so that we can resume download if we can ensure
-        # that existing octez_node.snapshot chunk belongs
+        # that existing snapshot chunk belongs
         # to the snapshot we want to download)
         # and start download from scratch
         dump_metadata()
         download()
 
-    print()
-    return filename
+    return finish()
 
 
 class Sha256Mismatch(Exception):
@@ -150,30 +430,384 @@ class InterruptStep(Exception):
     "Raised when there is need to interrupt step handling flow."
 
 
-def check_file_contents_integrity(filename, sha256):
-    import hashlib
+class SnapshotNotFound(InterruptStep):
+    "Raised when none of the providers has a suitable snapshot."
 
+
+# Reads the file by chunks, so that the memory usage doesn't depend
+# on the snapshot size
+def file_sha256(filename, chunk_size=4 * 1024 * 1024):
     sha256sum = hashlib.sha256()
+    progress = PhaseProgress("hash", os.path.getsize(filename))
     with open(filename, "rb") as f:
-        contents = f.read()
-    sha256sum.update(contents)
+        while chunk := f.read(chunk_size):
+            sha256sum.update(chunk)
+            progress.update(f.tell())
+    progress.finish()
+    return sha256sum.hexdigest()
+
 
-    actual_sha256 = str(sha256sum.hexdigest())
+def check_file_contents_integrity(filename, sha256):
     expected_sha256 = sha256
+    # the snapshot was downloaded compressed and the provided
+    # sha256 is of the compressed file
+    if get_streamed_sha256(filename, compressed_digests) == expected_sha256:
+        return
+    # the hash is already known if the file was downloaded in segments
+    actual_sha256 = get_streamed_sha256(filename)
+    if actual_sha256 is None:
+        actual_sha256 = file_sha256(filename)
 
     if actual_sha256 != expected_sha256:
         raise Sha256Mismatch(actual_sha256, expected_sha256)
 
 
-def is_full_snapshot(snapshot_file, import_mode):
-    if import_mode == "download full":
-        return True
-    if import_mode == "file" or import_mode == "url":
-        output = get_proc_output(
-            "sudo -u tezos octez-node snapshot info " + snapshot_file
-        ).stdout
-        return re.search(b"at level [0-9]+ in full", output) is not None
-    return False
+# Imports the snapshot while it's being downloaded: the octez-node reads it
+# from a named pipe, so that the snapshot is never stored on disk.
+# `import_cmd` is a function making the import command for the given file.
+def make_snapshot_fifo(dirname):
+    fifo = os.path.join(dirname, "octez_node.snapshot.fifo")
+    os.makedirs(dirname, exist_ok=True)
+    try:
+        os.remove(fifo)
+    except FileNotFoundError:
+        pass
+    os.mkfifo(fifo)
+    # the node is run by the 'tezos' user
+    os.chmod(fifo, 0o644)
+    return fifo
+
+
+# Opening the pipe blocks until the node opens it for reading,
+# so the non-blocking open is retried while the node is alive
+def open_snapshot_fifo(fifo, process, cmd):
+    fd = None
+    while fd is None:
+        try:
+            fd = os.open(fifo, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+            if process.poll() is not None:
+                raise subprocess.CalledProcessError(process.returncode, cmd)
+            time.sleep(0.1)
+    os.set_blocking(fd, True)
+    return os.fdopen(fd, "wb")
+
+
+def stream_snapshot_import(url, import_cmd, sha256=None, dirname=TMP_SNAPSHOT_LOCATION):
+    fifo = make_snapshot_fifo(dirname)
+    compression = detect_remote_compression(url)
+
+    cmd = import_cmd(fifo)
+    logging.info("Importing snapshot with the octez-node from the pipe")
+    process = subprocess.Popen(shlex.split(cmd))
+    # the progress of the import follows the download
+    import_progress = PhaseProgress(import_phase(cmd), streaming=True)
+
+    def stop_import():
+        if process.poll() is None:
+            process.terminate()
+        process.wait()
+
+    try:
+        output = open_snapshot_fifo(fifo, process, cmd)
+        print_and_log(f"Downloading the snapshot from {url}")
+        with output:
+            if compression is None:
+                actual_sha256 = download_to_stream(url, output)
+                decompressed_sha256 = actual_sha256
+            else:
+                print_and_log(
+                    f"The snapshot is {compression.name} compressed, "
+                    "it's decompressed while being downloaded."
+                )
+                decompressor = Decompressor(compression, output)
+                try:
+                    actual_sha256 = download_to_stream(url, decompressor)
+                    decompressed_sha256 = decompressor.finish()
+                except BaseException:
+                    decompressor.stop()
+                    raise
+            print()
+            # the pipe is still open, so the node can't finish the import
+            # of the corrupted snapshot
+            # the provided sha256 may be of either the compressed
+            # or the decompressed snapshot
+            if sha256 and sha256 not in [actual_sha256, decompressed_sha256]:
+                stop_import()
+                raise Sha256Mismatch(actual_sha256, sha256)
+    except BrokenPipeError:
+        process.wait()
+        error = subprocess.CalledProcessError(process.returncode, cmd)
+        import_progress.fail(error)
+        raise error
+    except BaseException as e:
+        stop_import()
+        import_progress.fail(e)
+        raise
+    finally:
+        os.remove(fifo)
+
+    if process.wait() != 0:
+        error = subprocess.CalledProcessError(process.returncode, cmd)
+        import_progress.fail(error)
+        raise error
+    import_progress.finish()
+
+
+# Copies the snapshot that is still open back to its removed staging
+# directory, so that the failed import doesn't lose the download
+def restore_staged_snapshot(snapshot, snapshot_file):
+    size = os.fstat(snapshot.fileno()).st_size
+    try:
+        make_user_dir(os.path.dirname(snapshot_file))
+        check_free_space(os.path.dirname(snapshot_file), size)
+        snapshot.seek(0)
+        with open(snapshot_file, "wb") as f:
+            shutil.copyfileobj(snapshot, f, CHUNK_SIZE)
+    except (OSError, NotEnoughSpace, subprocess.CalledProcessError) as e:
+        try:
+            os.remove(snapshot_file)
+        except OSError:
+            pass
+        print_and_log(
+            f"Couldn't keep the snapshot after the failed import: {e}",
+            log=logging.warning,
+            colorcode=color_yellow,
+        )
+        return
+    print_and_log(
+        f"The snapshot is kept in {snapshot_file}, "
+        "it can be imported again with the 'file' snapshot import mode."
+    )
+
+
+# The node only imports the snapshot into a clean data directory, so the
+# snapshot staged in it is opened, its directory is removed, and the node
+# reads it from the pipe. The directory has to be removed before the node
+# starts, the snapshot is copied back from the open file if the import fails.
+# Its space is freed once the import is over.
+def import_staged_snapshot(snapshot_file, staging_dir, import_cmd, progress):
+    fifo = make_snapshot_fifo(TMP_SNAPSHOT_LOCATION)
+    cmd = import_cmd(fifo)
+    try:
+        with open(snapshot_file, "rb") as snapshot:
+            shutil.rmtree(staging_dir)
+            logging.info(
+                "Importing the staged snapshot with the octez-node from the pipe"
+            )
+            with subprocess.Popen(shlex.split(cmd)) as process:
+                try:
+                    with open_snapshot_fifo(fifo, process, cmd) as output:
+                        while chunk := snapshot.read(CHUNK_SIZE):
+                            output.write(chunk)
+                            progress.update(snapshot.tell())
+                    returncode = process.wait()
+                except BrokenPipeError:
+                    returncode = process.wait()
+                except BaseException as e:
+                    process.kill()
+                    progress.fail(e)
+                    raise
+            if returncode != 0:
+                restore_staged_snapshot(snapshot, snapshot_file)
+    finally:
+        os.remove(fifo)
+    if returncode != 0:
+        error = subprocess.CalledProcessError(returncode, cmd)
+        progress.fail(error)
+        raise error
+    progress.finish()
+
+
+# Lowers the I/O priority of the wizard, so that it's inherited by
+# the download threads and processes started afterwards
+def apply_io_priority():
+    ionice_options = io_priorities[parsed_args.io_priority]
+    if ionice_options is not None:
+        logging.info(f"Setting the I/O priority to {parsed_args.io_priority}")
+        proc_call(f"ionice {ionice_options} -p {os.getpid()}")
+
+
+# Returns the directory containing the node data directory if they're
+# on the same filesystem. Placing the snapshots there avoids filling up
+# /tmp, which is often in RAM, and reading them across filesystems.
+# Otherwise, the snapshots are staged in the node data directory.
+def get_staging_root(network):
+    data_dir = os.path.normpath(get_data_dir(network))
+    root = os.path.dirname(data_dir)
+    try:
+        if os.stat(root).st_dev != os.stat(data_dir).st_dev:
+            logging.info("The node data directory is a mount point")
+            return None
+    except OSError as e:
+        logging.warning(f"Couldn't check the node data filesystem: {e}")
+        return None
+    return root
+
+
+# The snapshot is imported there when the node is rebootstrapped without
+# stopping it, it's on the same filesystem, so that it can be renamed
+def get_import_data_dir(node_dir):
+    return os.path.normpath(node_dir) + ".import"
+
+
+# The imported data can't be renamed to the node data directory if it's
+# a mount point, or if the previous import is on another filesystem
+def can_rebootstrap(node_dir):
+    node_dir = os.path.normpath(node_dir)
+    paths = [node_dir, os.path.dirname(node_dir)]
+    if os.path.exists(get_import_data_dir(node_dir)):
+        paths.append(get_import_data_dir(node_dir))
+    try:
+        return len(set(os.stat(path).st_dev for path in paths)) == 1
+    except OSError as e:
+        logging.warning(f"Couldn't check the node data filesystem: {e}")
+        return False
+
+
+def get_staging_dir(staging_root, node_dir):
+    if staging_root is not None:
+        staging_dir = os.path.join(staging_root, STAGING_DIR_NAME)
+    else:
+        staging_dir = os.path.join(node_dir, NODE_DIR_STAGING_NAME)
+    try:
+        make_user_dir(staging_dir)
+        return staging_dir
+    except (OSError, subprocess.CalledProcessError) as e:
+        logging.warning(f"Couldn't create {staging_dir}: {e}")
+    print_and_log(
+        f"Using {TMP_SNAPSHOT_LOCATION} for the snapshot, as there is no place "
+        "for it on the node data filesystem.",
+        log=logging.warning,
+        colorcode=color_yellow,
+    )
+    os.makedirs(TMP_SNAPSHOT_LOCATION, exist_ok=True)
+    return TMP_SNAPSHOT_LOCATION
+
+
+# Returns None if the cache is disabled or its directory can't be used
+def open_snapshot_cache(staging_root):
+    if parsed_args.snapshot_cache_size <= 0:
+        return None
+    cache_dir = parsed_args.snapshot_cache_dir
+    if cache_dir is None and staging_root is None:
+        # the snapshots are downloaded to the cache, which would put them
+        # off the node data filesystem, so they're staged there instead
+        print_and_log(
+            "The snapshot cache is disabled, since there is no place for it "
+            "on the node data filesystem. Use --snapshot-cache-dir to enable it."
+        )
+        return None
+    try:
+        if cache_dir is None:
+            cache_dir = os.path.join(staging_root, CACHE_DIR_NAME)
+            make_user_dir(cache_dir)
+        return SnapshotCache(cache_dir, parsed_args.snapshot_cache_size)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print_and_log(
+            f"Couldn't use the snapshot cache directory, the cache is disabled: {e}",
+            log=logging.warning,
+            colorcode=color_yellow,
+        )
+        return None
+
+
+# Headers of the snapshot files inspected by this process
+snapshot_headers_memo = {}
+
+
+# The file is identified by its inode, size and mtime along with the path,
+# so that a replaced or modified file is inspected again
+def snapshot_file_key(snapshot_file):
+    stat = os.stat(snapshot_file)
+    return ":".join(
+        [
+            os.path.realpath(snapshot_file),
+            str(stat.st_ino),
+            str(stat.st_size),
+            str(stat.st_mtime_ns),
+        ]
+    )
+
+
+# Returns the block hash, level, history mode and version of the snapshot
+# from the 'octez-node snapshot info' output, or None if it can't be parsed
+def parse_snapshot_info(output):
+    try:
+        info = json.loads(output)
+        header = info.get("snapshot_header", info)
+        return {
+            "block_hash": header["block_hash"],
+            "level": int(header["level"]),
+            "history_mode": header["mode"],
+            "version": header.get("version", None),
+        }
+    except (ValueError, KeyError, TypeError, AttributeError):
+        pass
+    # the text output of the versions without '--json'
+    text = output.decode("utf-8", errors="replace")
+    level_and_mode = re.search(r"at level ([0-9]+) in ([a-z]+)", text)
+    if level_and_mode is None:
+        return None
+    block_hash = re.search(r"\b(B[1-9A-HJ-NP-Za-km-z]{50})\b", text)
+    version = re.search(r"version ([0-9]+)", text)
+    return {
+        "block_hash": None if block_hash is None else block_hash.group(1),
+        "level": int(level_and_mode.group(1)),
+        "history_mode": level_and_mode.group(2),
+        "version": None if version is None else int(version.group(1)),
+    }
+
+
+# Returns the parsed header of the snapshot file, the file is scanned by
+# octez-node only once, the headers are cached on disk for the next runs
+def get_snapshot_header(snapshot_file):
+    try:
+        key = snapshot_file_key(snapshot_file)
+    except OSError:
+        return None
+    if key in snapshot_headers_memo:
+        return snapshot_headers_memo[key]
+    headers = read_cached_json(snapshot_headers_file, float("inf")) or {}
+    header = headers.get(key, None)
+    if header is None:
+        proc = get_proc_output(
+            "sudo -u tezos octez-node snapshot info --json " + snapshot_file
+        )
+        if proc.returncode != 0:
+            proc = get_proc_output(
+                "sudo -u tezos octez-node snapshot info " + snapshot_file
+            )
+        header = parse_snapshot_info(proc.stdout)
+        if header is None:
+            logging.warning(f"Couldn't parse the header of {snapshot_file}")
+            return None
+        # the entries of the removed and replaced files are dropped
+        path = key.rsplit(":", 3)[0]
+        headers = {
+            k: v
+            for k, v in headers.items()
+            if (other_path := k.rsplit(":", 3)[0]) != path
+            and os.path.exists(other_path)
+        }
+        headers[key] = header
+        write_cached_json(snapshot_headers_file, headers)
+    snapshot_headers_memo[key] = header
+    return header
+
+
+# The history mode of the streamed snapshot is taken from the provider's
+# metadata or the import mode, since the stream can't be inspected
+def is_full_snapshot(snapshot_file, import_mode, history_mode=None):
+    if history_mode is None and os.path.isfile(snapshot_file):
+        header = get_snapshot_header(snapshot_file)
+        if header is not None:
+            history_mode = header["history_mode"]
+    if history_mode is None:
+        return import_mode.startswith("download full")
+    return history_mode == "full"
 
 
 def is_non_protocol_testnet(network):
@@ -240,14 +874,22 @@ regions = {
     "asia": "Asian region",
 }
 
-region_step = Step(
-    id="region",
-    prompt="Choose the snapshot service closest to your servers:",
-    help="Snapshot download can take significant time to finish.\n"
-    "Choosing correct region will provide you better download speed.",
-    options=regions,
-    validator=Validator(validators.enum_range(regions)),
-)
+# We define this step as a function to preselect the fastest region
+def get_region_query(fastest_region=None):
+    default = "1"
+    if fastest_region in regions:
+        default = str(list(regions).index(fastest_region) + 1)
+    return Step(
+        id="region",
+        prompt="Choose the snapshot service closest to your servers:",
+        help="Snapshot download can take significant time to finish.\n"
+        "Choosing correct region will provide you better download speed.\n"
+        "The default is the region that was the fastest to download from.",
+        options=regions,
+        default=default,
+        validator=Validator(validators.enum_range(regions)),
+    )
+
 
 # We define this step as a function to better tailor snapshot options to the chosen history mode
 def get_snapshot_mode_query(config):
@@ -271,6 +913,11 @@ def get_snapshot_mode_query(config):
     for provider in default_providers:
         dynamic_import_modes[mk_option(provider.title)] = mk_desc(provider.title)
 
+    dynamic_import_modes[mk_option(fastest_to_sync)] = (
+        f"Import {history_mode} snapshot from the provider "
+        "that gets the node synced the soonest"
+    )
+
     import_modes = {**dynamic_import_modes, **static_import_modes}
 
     return Step(
@@ -293,19 +940,47 @@ def get_snapshot_mode_query(config):
     )
 
 
+snapshot_import_methods = {
+    "staged": "Download the whole snapshot first and then import it",
+    "streaming": "Import the snapshot while it's being downloaded",
+}
+
+snapshot_import_method_query = Step(
+    id="snapshot_import_method",
+    prompt="How would you like to import the snapshot?",
+    help="Streaming import passes the snapshot to the node while it's being downloaded,\n"
+    "so it takes less time and doesn't need disk space for the snapshot file.\n"
+    "However, an interrupted streaming import can't be resumed, and the sha256 check\n"
+    "only stops the import once the whole snapshot was downloaded.",
+    options=snapshot_import_methods,
+    validator=Validator(validators.enum_range(snapshot_import_methods)),
+)
+
 delete_node_data_options = {
     "no": "Keep the existing data",
     "yes": "Remove the data under the tezos node data directory",
+    "rebootstrap": "Keep the node running while the snapshot is imported next to "
+    "the existing data, then replace it",
 }
 
-delete_node_data_query = Step(
-    id="delete_node_data",
-    prompt="Delete this data and bootstrap the node again?",
-    help="It's possible to proceed with bootstrapping the node using\n"
-    "the existing blockchain data, instead of importing fresh snapshot.",
-    options=delete_node_data_options,
-    validator=Validator(validators.enum_range(delete_node_data_options)),
-)
+# We define this step as a function to hide 'rebootstrap' when it isn't possible
+def get_delete_node_data_query(rebootstrap=True):
+    options = dict(delete_node_data_options)
+    if not rebootstrap:
+        del options["rebootstrap"]
+    return Step(
+        id="delete_node_data",
+        prompt="Delete this data and bootstrap the node again?",
+        help="It's possible to proceed with bootstrapping the node using\n"
+        "the existing blockchain data, instead of importing fresh snapshot.\n"
+        "With 'rebootstrap', the node is only stopped for a few seconds to switch\n"
+        "to the imported data, but there should be enough space for both.",
+        options=options,
+        validator=Validator(validators.enum_range(options)),
+    )
+
+
+delete_node_data_query = get_delete_node_data_query()
 
 snapshot_file_query = Step(
     id="snapshot_file",
@@ -406,12 +1081,61 @@ def get_stake_tez_query(staked_balance, minimal_frozen_stake):
     )
 
 
+# Steps whose answers from the answers file are validated before the setup starts
+answerable_steps = [
+    network_query,
+    service_mode_query,
+    systemd_mode_query,
+    liquidity_toggle_vote_query,
+    get_region_query(),
+    snapshot_import_method_query,
+    delete_node_data_query,
+    snapshot_file_query,
+    provider_url_query,
+    snapshot_url_query,
+    snapshot_sha256_query,
+    history_mode_query,
+    get_key_mode_query(key_import_modes),
+    ignore_hash_mismatch_query,
+    secret_key_query,
+    remote_signer_uri_query,
+    derivation_path_query,
+    json_filepath_query,
+    replace_key_query,
+]
+# Steps whose options depend on the host or on the chain, validated once queried
+host_dependent_step_ids = [
+    "snapshot_mode",
+    "ledger_url",
+    "ledger_derivation",
+    "stake_tez",
+]
+
+
+def read_answers(path):
+    answers = load_answers(path)
+    validate_answers(answers, answerable_steps, host_dependent_step_ids)
+    # the snapshot modes depend on the history mode
+    if "history_mode" in answers:
+        validate_answers(
+            answers,
+            [get_snapshot_mode_query(answers)],
+            [step_id for step_id in answers if step_id != "snapshot_mode"],
+        )
+    return answers
+
+
+# Content of the node data dir that isn't blockchain data
+node_dir_not_data = node_dir_config | set([NODE_DIR_STAGING_NAME])
+
+
 class Setup(Setup):
     # Check if there is already some blockchain data in the octez-node data directory,
     # and ask the user if it can be overwritten.
     def check_blockchain_data(self):
         logging.info("Checking blockchain data")
         node_dir = get_data_dir(self.config["network"])
+        self.import_data_dir = None
         node_dir_contents = set()
         try:
             node_dir_contents = set(os.listdir(node_dir))
@@ -421,9 +1145,6 @@ class Setup(Setup):
             proc_call("sudo mkdir " + node_dir)
             proc_call("sudo chown tezos:tezos " + node_dir)
 
-        # Content expected in a configured and clean node data dir
-        node_dir_config = set(["config.json", "version.json"])
-
         # Configure data dir if the config is missing
         if not node_dir_config.issubset(node_dir_contents):
             print_and_log("The Tezos node data directory has not been configured yet.")
@@ -439,14 +1160,22 @@ class Setup(Setup):
                 + self.config["node_rpc_addr"]
             )
 
-        diff = node_dir_contents - node_dir_config
+        diff = node_dir_contents - node_dir_not_data
         if diff:
             logging.info(
                 "The Tezos node data directory already has some blockchain data"
             )
             print("The Tezos node data directory already has some blockchain data:")
             print("\n".join(["- " + os.path.join(node_dir, path) for path in diff]))
-            self.query_step(delete_node_data_query)
+            rebootstrap = can_rebootstrap(node_dir)
+            if not rebootstrap:
+                print_and_log(
+                    "The node can't be rebootstrapped, since its data directory "
+                    "isn't on the same filesystem as the directory containing it.",
+                    log=logging.warning,
+                    colorcode=color_yellow,
+                )
+            self.query_step(get_delete_node_data_query(rebootstrap))
             if self.config["delete_node_data"] == "yes":
                 # We first stop the node service, because it's possible that it
                 # will re-create some of the files while we go on with the wizard
@@ -456,33 +1185,194 @@ class Setup(Setup):
                     + self.config["network"]
                     + ".service"
                 )
-                for path in diff:
-                    try:
-                        proc_call("sudo rm -r " + os.path.join(node_dir, path))
-                    except:
-                        logging.error("Could not clean the Tezos node data directory.")
-                        print(
-                            "Could not clean the Tezos node data directory. "
-                            "Please do so manually."
-                        )
-                        raise OSError(
-                            "'sudo rm -r " + os.path.join(node_dir, path) + "' failed."
-                        )
-
-                print_and_log("Node directory cleaned.")
+                self.clean_node_data_dir(node_dir, diff)
+                return True
+            if self.config["delete_node_data"] == "rebootstrap":
+                self.import_data_dir = self.prepare_import_data_dir(node_dir)
                 return True
             return False
         return True
 
+    # Creates the data directory with the same config as the node's one,
+    # the node keeps running on its data during the import
+    def prepare_import_data_dir(self, node_dir):
+        import_dir = get_import_data_dir(node_dir)
+        if os.path.exists(import_dir):
+            print_and_log(f"Removing the previous unfinished import in {import_dir}")
+            proc_call(f"sudo rm -r {import_dir}")
+        proc_call(f"sudo -u tezos mkdir {import_dir}")
+        proc_call(
+            f"sudo -u tezos cp -p {os.path.join(node_dir, 'config.json')} {import_dir}"
+        )
+        print_and_log(f"The snapshot will be imported in {import_dir}")
+        return import_dir
+
+    # The data directory the snapshot is imported in
+    def get_import_target_dir(self):
+        if self.import_data_dir is not None:
+            return self.import_data_dir
+        return get_data_dir(self.config["network"])
+
+    # The node can't read the snapshot or the pipe from the data directory
+    # it imports into, since it has to be clean
+    def is_in_import_target_dir(self, path):
+        target_dir = os.path.normpath(self.get_import_target_dir())
+        return os.path.normpath(path).startswith(target_dir + os.sep)
+
+    # Switches the node to the freshly imported data, the node
+    # is stopped only for the time of renaming the directories
+    def swap_node_data_dir(self):
+        network = self.config["network"]
+        node_dir = os.path.normpath(get_data_dir(network))
+        old_dir = node_dir + ".old"
+        # the services depending on the node are stopped along with it
+        baking_active = (
+            get_proc_output(
+                f"systemctl is-active tezos-baking-{network}.service"
+            ).returncode
+            == 0
+        )
+
+        print_and_log("Stopping the node service to switch to the imported data")
+        self.systemctl_simple_action("stop", "node")
+        # the services are started again even if the data couldn't be switched
+        try:
+            # the node keeps its identity and known peers
+            for filename in ["identity.json", "peers.json"]:
+                path = os.path.join(node_dir, filename)
+                if os.path.exists(path):
+                    proc_call(f"sudo -u tezos cp -p {path} {self.import_data_dir}")
+            if os.path.exists(old_dir):
+                proc_call(f"sudo rm -r {old_dir}")
+            proc_call(f"sudo mv -T {node_dir} {old_dir}")
+            try:
+                proc_call(f"sudo mv -T {self.import_data_dir} {node_dir}")
+            except subprocess.CalledProcessError:
+                proc_call(f"sudo mv -T {old_dir} {node_dir}")
+                raise
+        finally:
+            self.systemctl_simple_action("start", "node")
+            if baking_active:
+                self.systemctl_simple_action("start", "baking")
+        print_and_log("The node service is restarted with the imported data.")
+
+        self.import_data_dir = None
+        proc_call(f"sudo rm -r {old_dir}")
+        print_and_log("Deleted the previous node data.")
+
+    def clean_node_data_dir(self, node_dir, paths):
+        for path in paths:
+            try:
+                proc_call("sudo rm -r " + os.path.join(node_dir, path))
+            except:
+                logging.error("Could not clean the Tezos node data directory.")
+                print(
+                    "Could not clean the Tezos node data directory. "
+                    "Please do so manually."
+                )
+                raise OSError(
+                    "'sudo rm -r " + os.path.join(node_dir, path) + "' failed."
+                )
+
+        print_and_log("Node directory cleaned.")
+
+    def snapshot_import_command(
+        self, snapshot_file, snapshot_block_hash=None, snapshot_history_mode=None
+    ):
+        reconstruct = self.config["history_mode"] == "archive" and is_full_snapshot(
+            snapshot_file, self.config["snapshot_mode"], snapshot_history_mode
+        )
+
+        if snapshot_block_hash is None and os.path.isfile(snapshot_file):
+            # the header is already known from the check above
+            header = get_snapshot_header(snapshot_file)
+            if header is not None:
+                snapshot_block_hash = header["block_hash"]
+
+        return snapshot_import_command(
+            self.config["network"],
+            snapshot_file,
+            snapshot_block_hash,
+            reconstruct,
+            self.import_data_dir,
+            parsed_args.io_priority,
+        )
+
+    # Runs the streaming snapshot import, the partially imported data
+    # is removed if the download fails
+    def stream_snapshot(
+        self, url, sha256=None, snapshot_block_hash=None, snapshot_history_mode=None
+    ):
+        try:
+            stream_snapshot_import(
+                url,
+                lambda fifo: self.snapshot_import_command(
+                    fifo, snapshot_block_hash, snapshot_history_mode
+                ),
+                sha256,
+                (
+                    TMP_SNAPSHOT_LOCATION
+                    if self.is_in_import_target_dir(self.staging_dir)
+                    else self.staging_dir
+                ),
+            )
+        except (
+            ValueError,
+            urllib.error.URLError,
+            Sha256Mismatch,
+            subprocess.CalledProcessError,
+            BrokenPipeError,
+        ) as e:
+            print()
+            if isinstance(e, Sha256Mismatch):
+                print_and_log("SHA256 mismatch.", logging.error)
+                print_and_log(f"Expected sha256: {e.expected_sha256}", logging.error)
+                print_and_log(f"Actual sha256: {e.actual_sha256}", logging.error)
+            elif isinstance(e, (subprocess.CalledProcessError, BrokenPipeError)):
+                # the decompressor or the node exited before the end of the snapshot
+                print_and_log(f"The snapshot import failed: {e}", logging.error)
+            else:
+                print_and_log(
+                    "The snapshot download failed, the import was stopped.",
+                    logging.error,
+                )
+            node_dir = self.get_import_target_dir()
+            self.clean_node_data_dir(
+                node_dir, set(os.listdir(node_dir)) - node_dir_not_data
+            )
+            raise InterruptStep
+
+    def request_snapshot_metadata(self, provider: Provider):
+        return provider.get_snapshot_metadata(
+            self.config["network"],
+            self.config["history_mode"],
+            self.config["region"],
+        )
+
+    # Requests the metadata from all the given providers at the same time,
+    # returns the functions waiting for the corresponding results
+    def request_snapshot_metadata_concurrently(self, providers):
+        executor = ThreadPoolExecutor(max_workers=len(providers))
+        futures = {
+            provider.title: executor.submit(self.request_snapshot_metadata, provider)
+            for provider in providers
+        }
+        # the results are awaited only when they're needed
+        executor.shutdown(wait=False)
+        return {title: future.result for title, future in futures.items()}
+
     # Check the provider url and collect the most recent snapshot
     # that is suited for the chosen history mode and network
-    def get_snapshot_metadata(self, provider: Provider):
+    #
+    # `request` is the function returning the provider's metadata,
+    # it's requested in place by default
+    def get_snapshot_metadata(self, provider: Provider, request=None):
+        if request is None:
+            request = lambda: self.request_snapshot_metadata(provider)
+        progress = PhaseProgress("metadata", provider=provider.title)
         try:
-            snapshot_metadata = provider.get_snapshot_metadata(
-                self.config["network"],
-                self.config["history_mode"],
-                self.config["region"],
-            )
+            snapshot_metadata = request()
+            progress.finish(found=snapshot_metadata is not None)
             if snapshot_metadata is None:
                 print_and_log(
                     f"No suitable snapshot found from the {provider.title} provider.",
@@ -492,24 +1382,61 @@ class Setup(Setup):
             else:
                 self.config["snapshots"][provider.title] = snapshot_metadata
 
-        except urllib.error.URLError:
+        except (urllib.error.URLError, socket.timeout) as e:
+            progress.fail(e)
             print_and_log(
                 f"\nCouldn't collect snapshot metadata from {provider.metadata_url} due to networking issues.\n",
                 log=logging.error,
                 colorcode=color_red,
             )
-        except ValueError:
+        except ValueError as e:
+            progress.fail(e)
             print_and_log(
                 f"\nCouldn't collect snapshot metadata from {provider.metadata_url} due to format mismatch.\n",
                 log=logging.error,
                 colorcode=color_red,
             )
         except Exception as e:
+            progress.fail(e)
             print_and_log(
                 f"\nUnexpected error handling snapshot metadata:\n{e}\n",
                 log=logging.error,
             )
 
+    # Collects the snapshots from the metadata requested along with
+    # the chosen provider, so that they can be used as download mirrors.
+    # The providers that don't respond in time are skipped.
+    def collect_mirror_metadata(self, requests, timeout=mirror_metadata_timeout):
+        for title, request in requests.items():
+            if title in self.config["snapshots"]:
+                continue
+            try:
+                snapshot_metadata = request(timeout=timeout)
+            except Exception as e:
+                logging.info(f"Couldn't get the snapshot metadata from {title}: {e}")
+                continue
+            if snapshot_metadata is not None:
+                self.config["snapshots"][title] = snapshot_metadata
+
+    # Returns the urls of the other providers' snapshots that are
+    # the same file as the snapshot of the `name` provider
+    def find_snapshot_mirrors(self, name):
+        snapshot = self.config["snapshots"][name]
+        mirrors = []
+        for title, other in self.config["snapshots"].items():
+            if title == name or other["url"] == snapshot["url"]:
+                continue
+            if other["block_hash"] != snapshot["block_hash"]:
+                continue
+            # e.g. TzInit doesn't provide the sha256, the size of the file
+            # is compared then, and the result is checked against
+            # the known sha256
+            if None not in [other["sha256"], snapshot["sha256"]]:
+                if other["sha256"] != snapshot["sha256"]:
+                    continue
+            mirrors.append(other["url"])
+        return mirrors
+
     def output_snapshot_metadata(self, name):
         from datetime import datetime
         from locale import setlocale, getlocale, LC_TIME
@@ -544,12 +1471,86 @@ block timestamp: {timestamp} ({time_ago})
             )
         )
 
+    # Raises `InterruptStep` if the user doesn't want to proceed
+    # with the corrupted snapshot
+    def check_snapshot_integrity(self, snapshot_file, sha256):
+        try:
+            print_and_log("Checking the snapshot integrity...")
+            check_file_contents_integrity(snapshot_file, sha256)
+            print_and_log("Integrity verified.")
+        except Sha256Mismatch as e:
+            print_and_log("SHA256 mismatch.", logging.error)
+            print_and_log(f"Expected sha256: {e.expected_sha256}", logging.error)
+            print_and_log(f"Actual sha256: {e.actual_sha256}", logging.error)
+            print()
+            self.query_step(ignore_hash_mismatch_query)
+            if self.config["ignore_hash_mismatch"] == "no":
+                raise InterruptStep
+            else:
+                logging.info("Ignoring hash mismatch")
+                return False
+        return True
+
+    # Returns the path of the cached snapshot, if any
+    def lookup_cached_snapshot(self, block_hash=None, sha256=None):
+        if self.snapshot_cache is None:
+            return None
+        cached = self.snapshot_cache.lookup(
+            self.config["network"], self.config["history_mode"], block_hash, sha256
+        )
+        if cached is None:
+            return None
+        print_and_log(f"Using the cached snapshot {cached['path']}")
+        return cached["path"]
+
+    # Moves the verified snapshot to the cache, returns its new path
+    def cache_snapshot(
+        self, snapshot_file, provider, block_hash=None, sha256=None, metadata=None
+    ):
+        if self.snapshot_cache is None:
+            return snapshot_file
+        try:
+            return self.snapshot_cache.store(
+                snapshot_file,
+                provider,
+                self.config["network"],
+                self.config["history_mode"],
+                block_hash,
+                sha256,
+                metadata,
+                get_streamed_sha256(snapshot_file),
+            )
+        except OSError as e:
+            logging.warning(f"Couldn't store the snapshot in the cache: {e}")
+            return snapshot_file
+
+    def snapshot_file_name(self, url, sha256=None):
+        return get_snapshot_file_name(
+            self.config["network"], self.config["history_mode"], url, sha256
+        )
+
+    def snapshot_download_dir(self):
+        if self.snapshot_cache is None:
+            return self.staging_dir
+        # so that the snapshot is moved to the cache without copying
+        return self.snapshot_cache.partial_dir
+
     def fetch_snapshot_from_provider(self, name):
         try:
-            url = self.config["snapshots"][name]["url"]
-            sha256 = self.config["snapshots"][name]["sha256"]
+            metadata = self.config["snapshots"][name]
+            url = metadata["url"]
+            sha256 = metadata["sha256"]
             self.output_snapshot_metadata(name)
-            return fetch_snapshot(url, sha256)
+            snapshot_file = self.lookup_cached_snapshot(metadata["block_hash"], sha256)
+            if snapshot_file is not None:
+                return snapshot_file
+            snapshot_file = fetch_snapshot(
+                url,
+                sha256,
+                self.snapshot_download_dir(),
+                self.find_snapshot_mirrors(name),
+                self.snapshot_file_name(url, sha256),
+            )
         except KeyError:
             raise InterruptStep
         except (ValueError, urllib.error.URLError):
@@ -561,6 +1562,12 @@ block timestamp: {timestamp} ({time_ago})
             print("internet connection or choose another option.")
             print()
             raise InterruptStep
+        if sha256 and not self.check_snapshot_integrity(snapshot_file, sha256):
+            # the corrupted snapshot isn't cached
+            return snapshot_file
+        return self.cache_snapshot(
+            snapshot_file, name, metadata["block_hash"], sha256, metadata
+        )
 
     def get_snapshot_from_provider(self, provider):
         try:
@@ -574,55 +1581,178 @@ block timestamp: {timestamp} ({time_ago})
     # check if a given provider has the compatible snapshot
     # available in its metadata and return the metadata of this
     # snapshot if it's available
-    def try_fallback_provider(self, provider):
+    def try_fallback_provider(self, provider, request=None):
         print(f"Getting snapshots' metadata from {provider.title} instead...")
-        self.get_snapshot_metadata(provider)
+        self.get_snapshot_metadata(provider, request)
         return self.config["snapshots"].get(provider.title, None)
 
     # check if some of the providers has the compatible snapshot
     # available in its metadadata and return the provider name
-    def find_fallback_provider(self, providers):
+    #
+    # `requests` are the pending metadata requests by provider title
+    def find_fallback_provider(self, providers, requests=None):
+        requests = requests or {}
         for provider in providers:
-            snapshot = self.try_fallback_provider(provider)
+            snapshot = self.try_fallback_provider(
+                provider, requests.get(provider.title, None)
+            )
             if snapshot is not None:
                 return provider
         return None
 
-    # tries to get the latest compatible snapshot from the given
+    # tries to find the latest compatible snapshot in the given
     # provider's metadata
     #
     # if the snapshot not found, tries to find it in other known
-    # providers
-    def get_snapshot_from_provider_with_fallback(self, provider):
+    # providers and returns the one that has it
+    def find_provider_with_snapshot(self, provider):
         print_and_log(f"Getting snapshots' metadata from {provider.title}...")
 
-        self.get_snapshot_metadata(provider)
+        fallback_providers = default_providers.copy()
+        fallback_providers.remove(provider)
+        mirror_providers = get_mirror_providers()
+        # the fallback metadata is requested at the same time, so that
+        # it's ready if the chosen provider doesn't have the snapshot
+        requests = self.request_snapshot_metadata_concurrently(
+            [provider] + fallback_providers + mirror_providers
+        )
+
+        self.get_snapshot_metadata(provider, requests[provider.title])
         snapshot = self.config["snapshots"].get(provider.title, None)
 
         if snapshot is None:
-            fallback_providers = default_providers.copy()
-            fallback_providers.remove(provider)
-            fallback_provider = self.find_fallback_provider(fallback_providers)
+            provider = self.find_fallback_provider(fallback_providers, requests)
+        if provider is not None:
+            self.collect_mirror_metadata(requests)
+        return provider
+
+    # Collects the snapshots from all the providers and estimates how soon
+    # each of them gets the node synced, from the throughput measured on
+    # the first bytes of the snapshot, its size and its age.
+    # Returns the title of the provider with the best one.
+    def find_fastest_to_sync_provider(self, streaming):
+        network, history_mode = self.config["network"], self.config["history_mode"]
+        for provider in default_providers:
+            if isinstance(provider, TzInit):
+                print_and_log("Looking for the fastest snapshot region...")
+                self.config["region"] = provider.find_fastest_region(
+                    network, history_mode
+                )
 
-            if fallback_provider is None:
+        providers = default_providers + get_mirror_providers()
+        print_and_log("Getting snapshots' metadata from all the providers...")
+        requests = self.request_snapshot_metadata_concurrently(providers)
+        for provider in providers:
+            self.get_snapshot_metadata(provider, requests[provider.title])
+        snapshots = self.config["snapshots"]
+        if not snapshots:
+            return None
+
+        print_and_log("Measuring the download throughput of the providers...")
+
+        def probe(title):
+            try:
+                return probe_download(snapshots[title]["url"])
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                logging.warning(f"Couldn't probe the snapshot from {title}: {e}")
                 return None
-            else:
-                provider = fallback_provider
+
+        with ThreadPoolExecutor(max_workers=len(snapshots)) as executor:
+            probes = dict(zip(snapshots, executor.map(probe, snapshots)))
+
+        rates = get_snapshot_rates()
+        import_rate = rates.get("import", default_import_rate)
+        catchup_rate = rates.get("catchup", default_catchup_rate)
+        block_time = estimate_block_time(snapshots.values())
+        estimates = []
+        for title, result in probes.items():
+            if result is None:
+                continue
+            throughput, remote = result
+            size = remote.size or snapshots[title].get("filesize_bytes", None)
+            if not size:
+                continue
+            # the snapshot is downloaded over several connections
+            if remote.accept_ranges:
+                throughput *= DEFAULT_CONNECTIONS
+            if isinstance(parsed_args.download_rate_limit, int):
+                throughput = min(throughput, parsed_args.download_rate_limit)
+            estimates.append(
+                estimate_time_to_sync(
+                    title,
+                    snapshots[title],
+                    size,
+                    throughput,
+                    import_rate,
+                    catchup_rate,
+                    block_time,
+                    streaming,
+                )
+            )
+        if not estimates:
+            return None
+
+        ranked = rank_snapshots(estimates)
+        print("Estimated time to get the node synced:")
+        for estimate in ranked:
+            print(
+                f"  {estimate.name}: {format_duration(estimate.total())} "
+                f"(download {format_duration(estimate.download_time)}, "
+                f"import {format_duration(estimate.import_time)}, "
+                f"catch-up {format_duration(estimate.catchup_time)})"
+            )
+            logging.info(f"Estimated time to sync: {estimate}")
+        print_and_log(f"Using the snapshot from {ranked[0].name}.")
+        return ranked[0].name
+
+    # Imports the provider's snapshot while it's being downloaded,
+    # unless it's cached
+    def stream_snapshot_from_provider(self, name):
+        self.output_snapshot_metadata(name)
+        snapshot = self.config["snapshots"][name]
+        snapshot_block_hash = snapshot["block_hash"]
+        snapshot_file = self.lookup_cached_snapshot(
+            snapshot_block_hash, snapshot["sha256"]
+        )
+        if snapshot_file is None:
+            self.stream_snapshot(
+                snapshot["url"],
+                snapshot["sha256"],
+                snapshot_block_hash,
+                # TzInit provides the snapshot header as the metadata
+                snapshot.get("history_mode", snapshot.get("mode", None)),
+            )
+        return (snapshot_file, snapshot_block_hash)
+
+    # tries to get the latest compatible snapshot from the given
+    # provider or its fallbacks
+    def get_snapshot_from_provider_with_fallback(self, provider):
+        provider = self.find_provider_with_snapshot(provider)
+        if provider is None:
+            return None
 
         snapshot_file = self.fetch_snapshot_from_provider(provider.title)
         snapshot_block_hash = self.config["snapshots"][provider.title]["block_hash"]
         return (snapshot_file, snapshot_block_hash)
 
     def get_snapshot_from_direct_url(self, url):
+        self.query_step(snapshot_sha256_query)
+        sha256 = self.config["snapshot_sha256"] or None
+        # without the sha256 it's unknown which snapshot the url points to
+        cached_snapshot = self.lookup_cached_snapshot(sha256=sha256)
+        if cached_snapshot is not None:
+            return (cached_snapshot, None)
+        self.query_step(snapshot_import_method_query)
+        if self.config["snapshot_import_method"] == "streaming":
+            self.stream_snapshot(url, sha256)
+            return (None, None)
         try:
-            self.query_step(snapshot_sha256_query)
-            sha256 = self.config["snapshot_sha256"]
-            snapshot_file = fetch_snapshot(url, sha256)
-            if sha256:
-                print_and_log("Checking the snapshot integrity...")
-                check_file_contents_integrity(snapshot_file, sha256)
-                print_and_log("Integrity verified.")
-            return (snapshot_file, None)
+            snapshot_file = fetch_snapshot(
+                url,
+                sha256,
+                self.snapshot_download_dir(),
+                name=self.snapshot_file_name(url, sha256),
+            )
         except (ValueError, urllib.error.URLError):
             print()
             logging.error("The snapshot url provided is unavailable.")
@@ -630,16 +1760,11 @@ block timestamp: {timestamp} ({time_ago})
             print("Please check the URL again or choose another option.")
             print()
             raise InterruptStep
-        except Sha256Mismatch as e:
-            print_and_log("SHA256 mismatch.", logging.error)
-            print_and_log(f"Expected sha256: {e.expected_sha256}", logging.error)
-            print_and_log(f"Actual sha256: {e.actual_sha256}", logging.error)
-            print()
-            if self.config["ignore_hash_mismatch"] == "no":
-                raise InterruptStep
-            else:
-                logging.info("Ignoring hash mismatch")
-                return (snapshot_file, None)
+        if sha256 and self.check_snapshot_integrity(snapshot_file, sha256):
+            snapshot_file = self.cache_snapshot(
+                snapshot_file, "direct url", sha256=sha256, metadata={"url": url}
+            )
+        return (snapshot_file, None)
 
     def get_snapshot_from_provider_url(self, url):
         provider = XtzShotsLike("custom", url)
@@ -660,15 +1785,27 @@ block timestamp: {timestamp} ({time_ago})
         if do_import:
             self.query_step(history_mode_query)
 
-            logging.info("Updating history mode octez-node config")
-            proc_call(
-                f"sudo -u tezos octez-node-{self.config['network']} config update "
-                f"--history-mode {self.config['history_mode']}"
+            update_history_mode(
+                self.config["network"],
+                self.get_import_target_dir(),
+                self.config["history_mode"],
             )
 
             self.config["snapshots"] = {}
 
-            os.makedirs(TMP_SNAPSHOT_LOCATION, exist_ok=True)
+            staging_root = get_staging_root(self.config["network"])
+            self.staging_dir = get_staging_dir(
+                staging_root, get_data_dir(self.config["network"])
+            )
+            self.snapshot_cache = open_snapshot_cache(staging_root)
+
+            set_download_rate_limit(parsed_args.download_rate_limit)
+            set_progress_events(
+                parsed_args.progress_events,
+                network=self.config["network"],
+                history_mode=self.config["history_mode"],
+            )
+            apply_io_priority()
 
         else:
             return
@@ -677,19 +1814,33 @@ block timestamp: {timestamp} ({time_ago})
 
             self.query_step(get_snapshot_mode_query(self.config))
 
-            snapshot_file = TMP_SNAPSHOT_LOCATION
+            snapshot_file = self.staging_dir
             snapshot_block_hash = None
+            # only TzInit snapshots are regional
+            self.config["region"] = None
 
             try:
                 if self.config["snapshot_mode"] == "skip":
+                    # the node keeps running on its data
+                    if self.import_data_dir is not None:
+                        proc_call(f"sudo rm -r {self.import_data_dir}")
+                        self.import_data_dir = None
                     return
                 elif self.config["snapshot_mode"] == "file":
                     self.query_step(snapshot_file_query)
                     snapshot_file = os.path.join(
-                        TMP_SNAPSHOT_LOCATION, f"file-{time.time()}.snapshot"
+                        self.staging_dir, f"file-{time.time()}.snapshot"
                     )
-                    # not copying since it can take a lot of time
-                    os.link(self.config["snapshot_file"], snapshot_file)
+                    try:
+                        # not copying since it can take a lot of time
+                        os.link(self.config["snapshot_file"], snapshot_file)
+                    except OSError:
+                        # the file is on another filesystem, so it's used in place
+                        snapshot_file = decompress_snapshot(
+                            self.config["snapshot_file"], keep_input=True
+                        )
+                    else:
+                        snapshot_file = decompress_snapshot(snapshot_file)
                 elif self.config["snapshot_mode"] == "direct url":
                     self.query_step(snapshot_url_query)
                     url = self.config["snapshot_url"]
@@ -704,58 +1855,145 @@ block timestamp: {timestamp} ({time_ago})
                         snapshot_file,
                         snapshot_block_hash,
                     ) = self.get_snapshot_from_provider_url(url)
+                elif fastest_to_sync in self.config["snapshot_mode"]:
+                    self.query_step(snapshot_import_method_query)
+                    streaming = self.config["snapshot_import_method"] == "streaming"
+                    name = self.find_fastest_to_sync_provider(streaming)
+                    if name is None:
+                        raise SnapshotNotFound
+                    if streaming:
+                        (
+                            snapshot_file,
+                            snapshot_block_hash,
+                        ) = self.stream_snapshot_from_provider(name)
+                    else:
+                        snapshot_file = self.fetch_snapshot_from_provider(name)
+                        snapshot_block_hash = self.config["snapshots"][name][
+                            "block_hash"
+                        ]
                 else:
                     for provider in default_providers:
                         if provider.title in self.config["snapshot_mode"]:
                             selected_provider = provider
-                    self.config["region"] = None
                     if isinstance(selected_provider, TzInit):
-                        self.query_step(region_step)
-                    snapshot_info = self.get_snapshot_from_provider_with_fallback(
-                        selected_provider
-                    )
-                    if snapshot_info is None:
-                        print_and_log(
-                            "Couldn't find available snapshot in any of the known providers.",
-                            log=logging.warning,
-                            colorcode=color_yellow,
+                        print_and_log("Looking for the fastest snapshot region...")
+                        fastest_region = selected_provider.find_fastest_region(
+                            self.config["network"], self.config["history_mode"]
                         )
-                        raise InterruptStep
-                    (snapshot_file, snapshot_block_hash) = snapshot_info
+                        self.query_step(get_region_query(fastest_region))
+                    self.query_step(snapshot_import_method_query)
+                    if self.config["snapshot_import_method"] == "streaming":
+                        provider = self.find_provider_with_snapshot(selected_provider)
+                        if provider is None:
+                            raise SnapshotNotFound
+                        (
+                            snapshot_file,
+                            snapshot_block_hash,
+                        ) = self.stream_snapshot_from_provider(provider.title)
+                    else:
+                        snapshot_info = self.get_snapshot_from_provider_with_fallback(
+                            selected_provider
+                        )
+                        if snapshot_info is None:
+                            raise SnapshotNotFound
+                        (snapshot_file, snapshot_block_hash) = snapshot_info
+            except NotEnoughSpace as e:
+                print()
+                print_and_log(
+                    str(e),
+                    log=logging.error,
+                    colorcode=color_red,
+                )
+                print_and_log("Getting back to the snapshot import mode step.")
+                continue
+            except SnapshotNotFound:
+                print_and_log(
+                    "Couldn't find available snapshot in any of the known providers.",
+                    log=logging.warning,
+                    colorcode=color_yellow,
+                )
+                print_and_log("Getting back to the snapshot import mode step.")
+                continue
             except InterruptStep:
                 print_and_log("Getting back to the snapshot import mode step.")
                 continue
 
             valid_choice = True
 
-            import_flag = ""
-            if is_full_snapshot(snapshot_file, self.config["snapshot_mode"]):
-                if self.config["history_mode"] == "archive":
-                    import_flag = "--reconstruct "
+            # the snapshot was imported while being downloaded
+            if snapshot_file is not None:
+                logging.info("Importing snapshot with the octez-node")
+                started_at = time.time()
+                import_cmd = self.snapshot_import_command(
+                    snapshot_file, snapshot_block_hash
+                )
+                snapshot_size = os.path.getsize(snapshot_file)
+                import_progress = PhaseProgress(
+                    import_phase(import_cmd),
+                    snapshot_size,
+                    expected_rate=get_snapshot_rates().get(
+                        "import", default_import_rate
+                    ),
+                )
+                if self.is_in_import_target_dir(snapshot_file):
+                    # the header can't be read from the pipe
+                    header = get_snapshot_header(snapshot_file) or {}
+                    import_staged_snapshot(
+                        snapshot_file,
+                        self.staging_dir,
+                        lambda fifo: self.snapshot_import_command(
+                            fifo,
+                            snapshot_block_hash or header.get("block_hash"),
+                            header.get("history_mode"),
+                        ),
+                        import_progress,
+                    )
+                else:
+                    call_with_progress(import_cmd, import_progress)
+                record_snapshot_rate("import", snapshot_size, time.time() - started_at)
 
-            block_hash_option = ""
-            if snapshot_block_hash is not None:
-                block_hash_option = " --block " + snapshot_block_hash
+            print_and_log("Snapshot imported.")
 
-            logging.info("Importing snapshot with the octez-node")
-            proc_call(
-                "sudo -u tezos octez-node-"
-                + self.config["network"]
-                + " snapshot import "
-                + import_flag
-                + snapshot_file
-                + block_hash_option
-            )
+            if self.import_data_dir is not None:
+                self.swap_node_data_dir()
 
-            print_and_log("Snapshot imported.")
+            # the cached snapshots are kept for the next imports
+            if self.snapshot_cache is not None and snapshot_file is not None:
+                self.snapshot_cache.clean_partial(snapshot_file)
 
             try:
-                shutil.rmtree(TMP_SNAPSHOT_LOCATION)
+                shutil.rmtree(self.staging_dir)
             except:
                 pass
             else:
                 print_and_log("Deleted the temporary snapshot file.")
 
+    # The durations of the bootstrap phases are kept for the capacity planning
+    def write_bootstrap_report(self):
+        network, history_mode = self.config["network"], self.config["history_mode"]
+        path = os.path.join(
+            os.getenv("HOME"),
+            ".tezos-logs",
+            f"bootstrap-{network}-{history_mode}-{time.strftime('%Y%m%d-%H%M%S')}.json",
+        )
+        try:
+            write_phase_report(
+                path,
+                network=network,
+                history_mode=history_mode,
+                snapshot_mode=self.config.get("snapshot_mode", None),
+            )
+        except OSError as e:
+            logging.warning(f"Couldn't write the bootstrap report: {e}")
+        else:
+            print_and_log(f"The bootstrap phase timings are written to {path}")
+
+    def get_head_level_or_none(self):
+        try:
+            return int(self.get_current_head_level())
+        except (RPCError, KeyError, ValueError):
+            return None
+
     # Bootstrapping octez-node
     def bootstrap_node(self):
 
@@ -767,19 +2005,21 @@ block timestamp: {timestamp} ({time_ago})
             "time, as the node needs a node identity to be generated."
         )
 
+        progress = PhaseProgress("start")
         self.systemctl_simple_action("start", "node")
 
         print_and_log("Waiting for the node service to start...")
 
         while True:
-            rpc_endpoint = self.config["node_rpc_endpoint"]
             try:
-                urllib.request.urlopen(rpc_endpoint + "/version")
+                self.rpc().get("/version")
                 break
-            except urllib.error.URLError:
+            except RPCError:
                 proc_call("sleep 1")
 
+        progress.finish()
         print_and_log("Generated node identity and started the service.")
+        self.write_bootstrap_report()
 
         self.systemctl_enable()
 
@@ -798,9 +2038,21 @@ block timestamp: {timestamp} ({time_ago})
         print_and_log("Waiting for the node to be bootstrapped...")
 
         tezos_client_options = self.get_tezos_client_options()
+        catchup_started_at = time.time()
+        start_level = self.get_head_level_or_none()
         proc_call(
             f"sudo -u tezos {suppress_warning_text} octez-client {tezos_client_options} bootstrapped"
         )
+        end_level = self.get_head_level_or_none()
+        # the rate is used to estimate how soon the node gets synced
+        # from the snapshots next time
+        if start_level is not None and end_level is not None:
+            if end_level - start_level >= min_block_time_sample:
+                record_snapshot_rate(
+                    "catchup",
+                    end_level - start_level,
+                    time.time() - catchup_started_at,
+                )
 
         print()
         print_and_log("The Tezos node bootstrapped successfully.")
@@ -848,25 +2100,18 @@ block timestamp: {timestamp} ({time_ago})
                     baker_set_up = True
 
     def stake_tez(self):
-        def get_minimal_frozen_stake():
-            output = get_proc_output(
-                f"curl {self.config['node_rpc_endpoint']}/chains/main/blocks/head/context/constants"
-            ).stdout.decode("utf-8")
-            return json.loads(output)["minimal_frozen_stake"]
-
-        def get_staked_balance(pkh):
-            output = get_proc_output(
-                f"curl {self.config['node_rpc_endpoint']}/chains/main/blocks/head/context/contracts/{pkh}/staked_balance"
-            ).stdout.decode("utf-8")
-            return json.loads(output)
-
         tezos_client_options = self.get_tezos_client_options()
         baker_alias = self.config["baker_alias"]
         baker_key_hash = self.config["baker_key_hash"]
 
-        minimal_frozen_stake = get_minimal_frozen_stake()
-
-        staked_balance = get_staked_balance(baker_key_hash)
+        # both are read from the same block
+        head = self.rpc().head_hash()
+        minimal_frozen_stake = self.rpc().get_block("context/constants", head)[
+            "minimal_frozen_stake"
+        ]
+        staked_balance = self.rpc().get_block(
+            f"context/contracts/{baker_key_hash}/staked_balance", head
+        )
 
         if int(staked_balance) < int(minimal_frozen_stake):
 
@@ -953,10 +2198,7 @@ block timestamp: {timestamp} ({time_ago})
         baker_alias = self.config["baker_alias"]
         _, baker_key_hash = get_key_address(tezos_client_options, baker_alias)
         try:
-            output = get_proc_output(
-                f"curl {self.config['node_rpc_endpoint']}/chains/main/blocks/head/context/delegates/{baker_key_hash}"
-            ).stdout.decode("utf-8")
-            response = json.loads(output)
+            response = self.rpc().get_block(f"context/delegates/{baker_key_hash}")
             return baker_key_hash in response["delegated_contracts"]
         except:
             return False
@@ -1050,9 +2292,17 @@ def main():
     readline.parse_and_bind("tab: complete")
     readline.set_completer_delims(" ")
 
+    answers = {}
+    if parsed_args.answers is not None:
+        try:
+            answers = read_answers(parsed_args.answers)
+        except (AnswersError, OSError) as e:
+            print(color(f"Couldn't use the answers file:\n{e}", color_red))
+            sys.exit(1)
+
     try:
         setup_logger("tezos-setup.log")
-        setup = Setup()
+        setup = Setup(answers=answers)
         setup.run_setup()
     except KeyboardInterrupt as e:
         if "network" in setup.config:
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2025 Oxhead Alpha
+# SPDX-License-Identifier: LicenseRef-MIT-OA
+
+"""
+Serves the snapshots from the local snapshot cache to the other hosts.
+
+The listing is compatible with tezos-snapshots.json, so the relay can be used
+as a custom provider in the 'provider url' snapshot import mode of tezos-setup.
+"""
+
+import os, sys
+import re
+import json
+import argparse
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from tezos_baking.util import *
+from tezos_baking.provider import get_node_version
+from tezos_baking.snapshot_cache import *
+
+# The cache directory used by tezos-setup when the node data directory
+# is the default one
+node_cache_dir = "/var/lib/tezos/tezos-snapshots"
+
+
+def default_cache_dir():
+    cache_dir = os.getenv("TEZOS_SNAPSHOT_CACHE_DIR")
+    if cache_dir is not None:
+        return cache_dir
+    if os.path.isdir(node_cache_dir):
+        return node_cache_dir
+    return DEFAULT_CACHE_DIR
+
+
+# Returns the artifact in the tezos-snapshots.json format, or None if
+# there is not enough metadata to list the snapshot
+def mk_artifact(entry, base_url, node_version):
+    metadata = entry.get("metadata") or {}
+    block_height = metadata.get("block_height", None)
+    block_timestamp = metadata.get("block_timestamp", None)
+    if entry["block_hash"] is None or block_height is None or block_timestamp is None:
+        return None
+    tezos_version = metadata.get("tezos_version", None)
+    if tezos_version is None:
+        # e.g. TzInit doesn't provide the version, the snapshot was imported
+        # on this host, so its octez-node version is used instead
+        major, minor, rc = node_version
+        tezos_version = {
+            "version": {
+                "major": major,
+                "minor": minor,
+                "additional_info": "release" if rc is None else {"rc": rc},
+            }
+        }
+    return {
+        "artifact_type": "tezos-snapshot",
+        "chain_name": entry["network"],
+        "history_mode": entry["history_mode"],
+        "block_hash": entry["block_hash"],
+        "block_height": block_height,
+        "block_timestamp": block_timestamp,
+        "url": f"{base_url}/snapshots/{entry['file']}",
+        "filename": entry["file"],
+        "filesize_bytes": entry["size"],
+        "filesize": format_size(entry["size"]),
+        # the relayed file may be decompressed, so the provider's sha256
+        # isn't necessarily of it
+        "sha256": entry.get("file_sha256", None),
+        "tezos_version": tezos_version,
+        # TzInit provides the snapshot version as 'version'
+        "snapshot_version": metadata.get(
+            "snapshot_version", metadata.get("version", None)
+        ),
+    }
+
+
+# Returns (start, end) of the requested byte range, with `end` excluded,
+# or raises ValueError if it can't be served
+def parse_range(header, size):
+    match = re.fullmatch(r"bytes=([0-9]*)-([0-9]*)", header.strip())
+    if match is None or match.group(1) == match.group(2) == "":
+        raise ValueError(f"Unsupported range: {header}")
+    first, last = match.groups()
+    if first == "":
+        # the suffix of the file
+        start, end = max(size - int(last), 0), size
+    else:
+        start = int(first)
+        end = size if last == "" else min(int(last) + 1, size)
+    if start >= end:
+        raise ValueError(f"Unsatisfiable range: {header}")
+    return (start, end)
+
+
+class RelayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def handle_request(self, send_body):
+        path = urlparse(self.path).path
+        if path in ["/", "/tezos-snapshots.json"]:
+            self.send_listing(send_body)
+        elif path.startswith("/snapshots/"):
+            self.send_snapshot(path[len("/snapshots/") :], send_body)
+        else:
+            self.send_error(404)
+
+    def get_entries(self):
+        try:
+            return self.server.cache.entries()
+        except PermissionError:
+            # the cache isn't writable by the relay
+            return list(self.server.cache.read_index().values())
+
+    def get_base_url(self):
+        if self.server.public_url is not None:
+            return self.server.public_url.rstrip("/")
+        host = self.headers.get("Host", None)
+        if host is None:
+            host = f"{self.server.server_address[0]}:{self.server.server_address[1]}"
+        return f"http://{host}"
+
+    def send_listing(self, send_body):
+        base_url = self.get_base_url()
+        artifacts = [
+            artifact
+            for entry in self.get_entries()
+            if (artifact := mk_artifact(entry, base_url, self.server.node_version))
+            is not None
+        ]
+        artifacts.sort(reverse=True, key=lambda x: x["block_height"])
+        body = json.dumps({"data": artifacts}, indent=2).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def send_snapshot(self, filename, send_body):
+        # only the files from the index are served
+        entry = next(
+            (entry for entry in self.get_entries() if entry["file"] == filename),
+            None,
+        )
+        if entry is None:
+            self.send_error(404)
+            return
+        try:
+            f = open(os.path.join(self.server.cache.directory, filename), "rb")
+        except FileNotFoundError:
+            self.send_error(404)
+            return
+        with f:
+            stat = os.fstat(f.fileno())
+            size = stat.st_size
+            etag = f'"{size:x}-{stat.st_mtime_ns:x}"'
+            byte_range = None
+            range_header = self.headers.get("Range", None)
+            # the range is ignored if the file has changed since the client
+            # got its beginning
+            if_range = self.headers.get("If-Range", None)
+            if range_header is not None and if_range in [None, etag]:
+                try:
+                    byte_range = parse_range(range_header, size)
+                except ValueError:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+            start, end = (0, size) if byte_range is None else byte_range
+
+            self.send_response(200 if byte_range is None else 206)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", self.date_time_string(stat.st_mtime))
+            self.send_header("Content-Length", str(end - start))
+            if byte_range is not None:
+                self.send_header("Content-Range", f"bytes {start}-{end - 1}/{size}")
+            self.end_headers()
+            if not send_body:
+                return
+            if start == 0:
+                try:
+                    self.server.cache.touch(filename)
+                except PermissionError:
+                    pass
+            try:
+                self.connection.sendfile(f, start, end - start)
+            except (BrokenPipeError, ConnectionResetError):
+                logging.info(f"{self.client_address[0]} closed the connection")
+                self.close_connection = True
+
+    def log_message(self, format, *args):
+        logging.info(f"{self.client_address[0]} {format % args}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve the snapshots cached by tezos-setup to other hosts."
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=default_cache_dir(),
+        help="Snapshot cache directory of tezos-setup. "
+        f"Is '{node_cache_dir}' if it exists or '{DEFAULT_CACHE_DIR}' by default.",
+    )
+    parser.add_argument(
+        "--host",
+        default="0.0.0.0",
+        help="Address to listen on. Is '0.0.0.0' by default.",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8750,
+        help="Port to listen on. Is 8750 by default.",
+    )
+    parser.add_argument(
+        "--public-url",
+        default=None,
+        help="Base url of the relay used in the listing, e.g. when it's behind "
+        "a proxy. By default, it's taken from the Host header of the request.",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s|%(levelname)s|%(message)s",
+        datefmt="%Y-%m-%dT%H:%M:%S",
+    )
+
+    try:
+        node_version = get_node_version()
+    except Exception:
+        logging.warning("Couldn't get the octez-node version")
+        node_version = (0, 0, None)
+
+    server = ThreadingHTTPServer((args.host, args.port), RelayHandler)
+    server.daemon_threads = True
+    server.cache = SnapshotCache(args.cache_dir)
+    server.public_url = args.public_url
+    server.node_version = node_version
+
+    print(f"Serving the snapshots from {args.cache_dir}")
+    print(
+        "Use the following provider url in tezos-setup: "
+        f"http://<this host>:{args.port}/tezos-snapshots.json"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -136,12 +136,17 @@ ballot_outcome_query = Step(
 
 def get_node_rpc_endpoint_query(network, default=None):
     url_path = "chains/main/blocks/head/header"
-    node_is_alive = lambda host: url_is_reachable(mk_full_url(host, url_path))
+    # the public nodes are checked all at once
+    alive_nodes = check_urls(
+        [mk_full_url(url, url_path) for url in public_nodes]
+        if network == "mainnet"
+        else []
+    )
 
     relevant_nodes = {
         url: provider
         for url, provider in public_nodes.items()
-        if network == "mainnet" and node_is_alive(url)
+        if alive_nodes.get(mk_full_url(url, url_path), None) is not None
     }
     return Step(
         id="node_rpc_endpoint",
@@ -301,24 +306,26 @@ class Setup(Setup):
 
     def fill_voting_period_info(self):
         logging.info("Filling in voting period info")
-        logging.info("Getting voting period from octez-client")
-        voting_proc = get_proc_output(
-            f"sudo -u tezos {suppress_warning_text} octez-client "
-            f"{self.config['tezos_client_options']} show voting period"
-        )
-        if voting_proc.returncode == 0:
-            info = voting_proc.stdout
-        else:
+        logging.info("Getting voting period from the node")
+        try:
+            # all of them are read from the same block
+            head = self.rpc().head_hash()
+            period = self.rpc().get_block("votes/current_period", head)
+            phase = period["voting_period"]["kind"]
+            if phase == "proposal":
+                proposals = self.rpc().get_block("votes/proposals", head)
+                proposal_hashes = [phash for phash, _ in proposals]
+            else:
+                current_proposal = self.rpc().get_block("votes/current_proposal", head)
+                proposal_hashes = [] if current_proposal is None else [current_proposal]
+        except (RPCError, KeyError, TypeError, ValueError) as e:
             print_and_log("Couldn't get the voting period info.", logging.error)
+            logging.error(str(e))
             print("Please check that the network for voting has been set up correctly.")
             raise KeyboardInterrupt
 
-        self.config["amendment_phase"] = (
-            re.search(b'Current period: "(\\w+)"', info).group(1).decode("utf-8")
-        )
-        self.config["proposal_hashes"] = [
-            phash.decode() for phash in re.findall(protocol_hash_regex, info)
-        ]
+        self.config["amendment_phase"] = phase
+        self.config["proposal_hashes"] = proposal_hashes
 
     def process_proposal_period(self):
         logging.info("Processing proposal period")
@@ -467,7 +474,7 @@ class Setup(Setup):
         if self.check_ledger_use():
             wait_for_ledger_app("Wallet", self.config["client_data_dir"])
 
-        # process 'tezos-client show voting period'
+        # read the current voting period and its proposals from the node RPC
         self.fill_voting_period_info()
 
         print_and_log(
@@ -10,6 +10,12 @@ import re
 import urllib.request
 import json
 import os
+import time
+import hashlib
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
 
 # Regexes
 
@@ -102,6 +108,24 @@ def progressbar_hook(chunk_number, chunk_size, total_size):
     print("Progress:", percent, "%,", int(done / (1024 * 1024)), "MB", end="\r")
 
 
+def format_size(nbytes):
+    suffixes = ["B", "KB", "MB", "GB", "TB", "PB"]
+    i = 0
+    while nbytes >= 1024 and i < len(suffixes) - 1:
+        nbytes /= 1024.0
+        i += 1
+    f = ("%.2f" % nbytes).rstrip("0").rstrip(".")
+    return "%s%s" % (f, suffixes[i])
+
+
+def format_duration(seconds):
+    if seconds == float("inf"):
+        return "unknown"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}"
+
+
 def color(input, colorcode):
     return colorcode + input + "\x1b[0m"
 
@@ -141,10 +165,180 @@ def mk_full_url(host_name, path):
     return url
 
 
-def url_is_reachable(url):
-    req = urllib.request.Request(url, headers=http_request_headers)
+@dataclass
+class RemoteFile:
+    # url after following all the redirects
+    url: str
+    size: Optional[int]
+    accept_ranges: bool
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+# in seconds
+url_check_timeout = 10
+url_check_cache_ttl = 60
+# so that the url fixed by the user is checked again soon
+url_check_failure_ttl = 5
+
+# Results of the recent url checks of this process by url,
+# the failures are cached as well
+url_check_memo = {}
+
+
+def mk_remote_file(response):
+    accept_ranges = response.status == 206
+    if accept_ranges:
+        match = re.search(r"/([0-9]+)$", response.headers.get("Content-Range", ""))
+        size = int(match.group(1)) if match is not None else None
+    else:
+        accept_ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+        content_length = response.headers.get("Content-Length")
+        size = int(content_length) if content_length is not None else None
+    return RemoteFile(
+        url=response.geturl(),
+        size=size,
+        accept_ranges=accept_ranges,
+        etag=response.headers.get("ETag"),
+        last_modified=response.headers.get("Last-Modified"),
+    )
+
+
+# Returns the RemoteFile served at `url` without transferring its body,
+# raises the request error if it's unreachable. The url is requested with HEAD,
+# and the servers that don't allow HEAD are asked for the first byte with GET.
+# The result is shared by the callers within `ttl`, so it mustn't be modified.
+def check_url(url, timeout=url_check_timeout, ttl=url_check_cache_ttl):
+    now = time.time()
+    memo = url_check_memo.get(url, None)
+    if memo is not None:
+        checked_at, result = memo
+        failed = isinstance(result, Exception)
+        if now - checked_at <= (min(ttl, url_check_failure_ttl) if failed else ttl):
+            if failed:
+                raise result
+            return result
+
+    try:
+        request = urllib.request.Request(
+            url, headers=http_request_headers, method="HEAD"
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                result = mk_remote_file(response)
+        except urllib.error.HTTPError:
+            request = urllib.request.Request(
+                url, headers={**http_request_headers, "Range": "bytes=0-0"}
+            )
+            # the body isn't read, the connection is closed instead
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                result = mk_remote_file(response)
+    except (OSError, ValueError, http.client.HTTPException) as e:
+        url_check_memo[url] = (now, e)
+        raise e
+    url_check_memo[url] = (now, result)
+    return result
+
+
+# Checks the urls in parallel, returns the RemoteFile of every reachable url
+# or None for the unreachable ones
+def check_urls(urls, timeout=url_check_timeout):
+    def check(url):
+        try:
+            return check_url(url, timeout)
+        except Exception:
+            return None
+
+    urls = list(urls)
+    if not urls:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        return dict(zip(urls, executor.map(check, urls)))
+
+
+def url_is_reachable(url, timeout=url_check_timeout):
+    return check_urls([url], timeout)[url] is not None
+
+
+# Per-user cache for the data that is expensive to get every time,
+# see https://specifications.freedesktop.org/basedir-spec/latest/
+def get_cache_dir():
+    cache_home = os.getenv("XDG_CACHE_HOME") or os.path.join(
+        os.getenv("HOME"), ".cache"
+    )
+    return os.path.join(cache_home, "tezos-baking")
+
+
+# Returns None if the cached value is missing or older than `ttl` seconds
+def read_cached_json(name, ttl):
+    path = os.path.join(get_cache_dir(), name)
+    try:
+        if time.time() - os.path.getmtime(path) > ttl:
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_cached_json(name, value):
+    path = os.path.join(get_cache_dir(), name)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump(value, f)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        # the cache is an optimization only
+        pass
+
+
+# in seconds
+http_cache_ttl = 5 * 60
+http_cache_timeout = 30
+
+# Parsed responses of this process by url
+http_cache_memo = {}
+
+
+# Returns the parsed JSON served at `url`. The responses are cached on disk
+# and revalidated with a conditional GET once they're older than `ttl`.
+# The returned value is shared by all the callers, so it mustn't be modified.
+def get_json_cached(url, ttl=http_cache_ttl, timeout=http_cache_timeout):
+    now = time.time()
+    memo = http_cache_memo.get(url, None)
+    if memo is not None and now - memo["fetched_at"] <= ttl:
+        return memo["body"]
+
+    name = os.path.join("http", hashlib.sha256(url.encode()).hexdigest() + ".json")
+    entry = memo or read_cached_json(name, float("inf"))
+    if entry is not None and entry.get("url") != url:
+        entry = None
+    if entry is not None and now - entry["fetched_at"] <= ttl:
+        http_cache_memo[url] = entry
+        return entry["body"]
+
+    headers = dict(http_request_headers)
+    if entry is not None:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    request = urllib.request.Request(url, headers=headers)
     try:
-        urllib.request.urlopen(req)
-        return True
-    except (urllib.error.URLError, ValueError):
-        return False
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body = json.load(response)
+            entry = {
+                "url": url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "body": body,
+            }
+    except urllib.error.HTTPError as e:
+        # the listing hasn't changed since it was cached
+        if e.code != 304 or entry is None:
+            raise e
+    entry["fetched_at"] = now
+    http_cache_memo[url] = entry
+    write_cached_json(name, entry)
+    return entry["body"]
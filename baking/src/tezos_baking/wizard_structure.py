@@ -20,6 +20,7 @@ from tezos_baking.util import *
 from tezos_baking.validators import Validator
 import tezos_baking.validators as validators
 from tezos_baking.steps import *
+from tezos_baking.rpc import RPCClient, RPCError
 
 # Command line argument parsing
 
@@ -138,11 +139,99 @@ def log_exception(exception, logfile):
     print(f"> cat {os.path.join('~', log_dir, logfile)}")
 
 
+class AnswersError(Exception):
+    "Raised when the answers file can't be read or has invalid answers."
+
+
+# YAML reads 'yes' and 'no' as booleans, while the steps expect them as strings
+def format_answer(value):
+    if isinstance(value, bool):
+        return "yes" if value else "no"
+    if value is None:
+        return ""
+    if isinstance(value, (str, int, float)):
+        return str(value)
+    raise ValueError("The answer should be a string or a number.")
+
+
+# Reads the answers to the steps keyed by the step ids from the JSON or YAML file
+def load_answers(path):
+    with open(os.path.expanduser(path), "r") as f:
+        content = f.read()
+    try:
+        answers = json.loads(content)
+    except json.JSONDecodeError as e:
+        try:
+            import yaml
+        except ImportError:
+            raise AnswersError(
+                f"{path} isn't valid JSON: {e}. "
+                "Install PyYAML in order to read it as YAML."
+            )
+        try:
+            answers = yaml.safe_load(content)
+        except yaml.YAMLError as e:
+            raise AnswersError(f"{path} isn't valid JSON or YAML: {e}")
+    if not isinstance(answers, dict):
+        raise AnswersError(f"{path} should map the step ids to the answers.")
+    errors = []
+    for step_id, value in answers.items():
+        try:
+            answers[step_id] = format_answer(value)
+        except ValueError as e:
+            errors.append(f"{step_id}: {e}")
+    if errors:
+        raise AnswersError("\n".join(errors))
+    return answers
+
+
+# Validates the answers to the given steps in advance, replacing them with
+# the validated values, e.g. the option numbers with the option names.
+# The answers to `other_step_ids` depend on the state of the host,
+# so they're only validated once their steps are queried.
+def validate_answers(answers, steps, other_step_ids=()):
+    known_ids = set(step.id for step in steps) | set(other_step_ids)
+    errors = [
+        f"{step_id}: Unknown step." for step_id in answers if step_id not in known_ids
+    ]
+    for step in steps:
+        if step.id not in answers:
+            continue
+        try:
+            answers[step.id] = validate_step_answer(step, answers[step.id])
+        except ValueError as e:
+            errors.append(f"{step.id}: {e}")
+    if errors:
+        raise AnswersError("\n".join(errors))
+
+
+def validate_step_answer(step, answer):
+    if not answer and step.default is not None:
+        answer = step.default
+    if step.validator is not None:
+        answer = step.validator.validate(answer)
+    return answer
+
+
 class Setup:
-    def __init__(self, config={}):
+    def __init__(self, config={}, answers=None):
         self.config = config
+        # the steps with an answer aren't queried, every answer is used only once,
+        # so that the step is queried if the wizard gets back to it
+        self.answers = dict(answers or {})
+        self.rpc_client = None
 
     def query_step(self, step: Step):
+        if step.id in self.answers:
+            answer = self.answers.pop(step.id)
+            try:
+                self.config[step.id] = validate_step_answer(step, answer)
+            except ValueError as e:
+                raise AnswersError(f"Invalid answer to the '{step.id}' step: {e}")
+            print_and_log(f"Using the '{step.id}' answer from the answers file.")
+            logging.info(f"config|{step.id}|{self.config[step.id]}")
+            return
+
         validated = False
         logging.info(f"Querying step: {step.id}")
         while not validated:
@@ -236,11 +325,18 @@ class Setup:
         self.config["remote_host"] = rsu.group(1)
         self.config["remote_key"] = rsu.group(2)
 
+    # Returns the client of the node RPC, the connection to the node
+    # is reused until the endpoint changes
+    def rpc(self):
+        endpoint = self.config["node_rpc_endpoint"]
+        if self.rpc_client is None or self.rpc_client.endpoint != endpoint:
+            if self.rpc_client is not None:
+                self.rpc_client.close()
+            self.rpc_client = RPCClient(endpoint)
+        return self.rpc_client
+
     def get_current_head_level(self):
-        response = urllib.request.urlopen(
-            self.config["node_rpc_endpoint"] + "/chains/main/blocks/head/header"
-        )
-        return str(json.load(response)["level"])
+        return str(self.rpc().get_block("header")["level"])
 
     # Check whether the baker_alias account is set up to use ledger
     def check_ledger_use(self, key=None):
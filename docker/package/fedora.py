@@ -5,7 +5,7 @@ import os, shutil, subprocess
 from typing import List
 
 from .model import AbstractPackage
-from .systemd import print_service_file
+from .systemd import print_service_file, print_timer_file
 
 
 def build_fedora_package(
@@ -42,6 +42,10 @@ def build_fedora_package(
             else f"{dir}/{unit_name}.service"
         )
         print_service_file(systemd_unit.service_file, out_path)
+        if systemd_unit.timer is not None:
+            print_timer_file(
+                systemd_unit.timer, out_path[: -len(".service")] + ".timer"
+            )
         if systemd_unit.config_file is not None:
             default_name = (
                 unit_name if systemd_unit.instances is None else f"{unit_name}@"
@@ -142,6 +142,14 @@ def gen_spec_systemd_part(package):
         systemd_units_post += f"%systemd_post {service_name}.service\n"
         systemd_units_preun += f"%systemd_preun {service_name}.service\n"
         systemd_units_postun += f"%systemd_postun_with_restart {service_name}.service\n"
+        if systemd_unit.timer is not None:
+            install_unit_files += (
+                f"install -m 644 {service_name}.timer %{{buildroot}}/%{{_unitdir}}\n"
+            )
+            systemd_unit_files += f"%{{_unitdir}}/{service_name}.timer\n"
+            systemd_units_post += f"%systemd_post {service_name}.timer\n"
+            systemd_units_preun += f"%systemd_preun {service_name}.timer\n"
+            systemd_units_postun += f"%systemd_postun {service_name}.timer\n"
         if systemd_unit.config_file is not None:
             install_default += (
                 f"install -m 644 {service_name}.default "
@@ -752,6 +760,8 @@ Maintainer: {self.meta.maintainer}
 %files
 %{{_bindir}}/tezos-setup
 %{{_bindir}}/tezos-vote
+%{{_bindir}}/tezos-snapshot-relay
+%{{_bindir}}/tezos-bootstrap
 %{{python3_sitelib}}/tezos_baking*
 %license LICENSE
 {systemd_files}
@@ -11,7 +11,7 @@ from .model import (
     TezosBakingServicesPackage,
 )
 
-from .systemd import Service, ServiceFile, SystemdUnit, Unit, Install
+from .systemd import Service, ServiceFile, SystemdUnit, Unit, Install, Timer
 from collections import ChainMap
 
 # Testnets are either supported by the tezos-node directly or have known URL with
@@ -301,6 +301,41 @@ custom_node_instantiated = mk_node_unit(
 )
 custom_node_instantiated.poststop_script = "tezos-node-custom-poststop"
 node_units.append(custom_node_instantiated)
+# Add the periodic snapshot export from the node of the given network,
+# e.g. 'tezos-node-snapshot-export@mainnet.timer'
+node_units.append(
+    SystemdUnit(
+        suffix="snapshot-export",
+        service_file=ServiceFile(
+            Unit(
+                after=["network.target", "tezos-node-%i.service"],
+                description="Tezos node %i snapshot export",
+            ),
+            Service(
+                environment_files=[
+                    "/etc/default/tezos-node-%i",
+                    "/etc/default/tezos-node-snapshot-export@",
+                    "-/etc/default/tezos-node-snapshot-export@%i",
+                ],
+                exec_start="/usr/bin/tezos-node-snapshot-export %i",
+                timeout_start_sec="infinity",
+                state_directory="tezos",
+                user="tezos",
+                type_="oneshot",
+            ),
+            Install(),
+        ),
+        startup_script="tezos-node-snapshot-export",
+        instances=[],
+        config_file="tezos-node-snapshot-export.conf",
+        timer=Timer(
+            description="Periodic Tezos node %i snapshot export",
+            on_calendar="daily",
+            randomized_delay_sec="1h",
+            persistent=True,
+        ),
+    )
+)
 
 
 packages.append(
@@ -42,6 +42,15 @@ class ServiceFile:
     install: Install
 
 
+# Activates the service of the same name
+@dataclass
+class Timer:
+    description: str
+    on_calendar: str
+    randomized_delay_sec: str = None
+    persistent: bool = False
+
+
 @dataclass
 class SystemdUnit:
     service_file: ServiceFile
@@ -55,6 +64,7 @@ class SystemdUnit:
     config_file: str = None
     config_file_append: List[str] = None
     instances: List[str] = None
+    timer: Timer = None
 
 
 def print_service_file(service_file: ServiceFile, out):
@@ -114,3 +124,20 @@ Group={service_file.service.user}
 """
     with open(out, "w") as f:
         f.write(file_contents)
+
+
+def print_timer_file(timer: Timer, out):
+    file_contents = f"""# SPDX-FileCopyrightText: 2025 Oxhead Alpha
+#
+# SPDX-License-Identifier: LicenseRef-MIT-OA
+[Unit]
+Description={timer.description}
+[Timer]
+OnCalendar={timer.on_calendar}
+{f"RandomizedDelaySec={timer.randomized_delay_sec}" if timer.randomized_delay_sec is not None else ""}
+{"Persistent=true" if timer.persistent else ""}
+[Install]
+WantedBy=timers.target
+"""
+    with open(out, "w") as f:
+        f.write(file_contents)